@@ -0,0 +1,36 @@
+"""
+Benchmarks, run from the repository root as python -m benchmarks.<name>
+
+Importing the package puts the repository on the import path and moves
+into a new temporary directory: database.db is resolved against working
+directory, a benchmark creates it there instead of in the repo.
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+# directory the benchmark was started from, for paths given on command line
+CWD = Path.cwd()
+sys.path.insert(0, str(ROOT))
+os.chdir(tempfile.mkdtemp(prefix="routina-bench-"))
+
+
+# the app is imported on first use, some benchmarks run it in another process
+async def migrate_database() -> None:
+    """Creates database.db, or upgrades it to the current schema, without SQL echo"""
+    from src.database import engine, read_engine
+    from src.migrations import migrate
+
+    engine.echo = read_engine.echo = False
+    await migrate()
+
+
+async def dispose_engines() -> None:
+    """Closes pooled connections, the event loop can not do it once closed"""
+    from src.database import engine, read_engine
+
+    await engine.dispose()
+    await read_engine.dispose()
@@ -0,0 +1,351 @@
+"""
+Load test of the API hot paths: register, login, list and create activities,
+read and toggle history. Concurrent clients run each scenario in turn against
+a seeded dataset, throughput and p50/p95/p99 latency are reported per scenario.
+
+The app runs in-process by default, --uvicorn starts it in a local uvicorn
+server instead. Results are written as JSON with --output. Given a --baseline
+results file, exits with status 1 when a scenario got slower than --threshold.
+
+Usage:
+    python -m benchmarks.api --output baseline.json
+    python -m benchmarks.api --baseline baseline.json --threshold 0.2
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+from time import perf_counter
+
+from httpx import ASGITransport, AsyncClient, Response, TransportError
+
+from benchmarks import CWD, ROOT, dispose_engines, migrate_database
+
+
+YEAR = 2024
+PASSWORD = "benchmark"
+
+
+class User:
+    def __init__(self, username: str):
+        self.username = username
+        self.session_id = ""
+        self.activity_ids: list[str] = []
+
+
+Request = Callable[[AsyncClient, User, int], Awaitable[Response]]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.api")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent clients")
+    parser.add_argument(
+        "--requests", type=int, default=200, help="requests per client and scenario"
+    )
+    parser.add_argument(
+        "--auth-requests",
+        type=int,
+        default=5,
+        help="requests per client for register and login, they hash passwords",
+    )
+    parser.add_argument("--users", type=int, default=8, help="seeded users")
+    parser.add_argument(
+        "--activities", type=int, default=20, help="seeded activities per user"
+    )
+    parser.add_argument(
+        "--months", type=int, default=12, help="seeded months of history per activity"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument(
+        "--uvicorn", action="store_true", help="serve the app with a local uvicorn"
+    )
+    parser.add_argument("--output", type=Path, help="write results to this file")
+    parser.add_argument("--baseline", type=Path, help="results file to compare with")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="allowed p95 latency increase and throughput decrease, 0.2 = 20%%",
+    )
+    args = parser.parse_args()
+    if not 1 <= args.months <= 12:
+        parser.error("--months must be between 1 and 12")
+    return args
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def start_uvicorn() -> tuple[subprocess.Popen, str]:
+    env = {**os.environ, "PYTHONPATH": str(ROOT)}
+    subprocess.run([sys.executable, "-m", "src.migrations"], env=env, check=True)
+    port = free_port()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "src.main:app",
+            "--port",
+            str(port),
+            # clients tell their address in X-Forwarded-For, see Target.client
+            "--proxy-headers",
+            "--forwarded-allow-ips=*",
+        ],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    async with AsyncClient(base_url=base_url) as client:
+        for _ in range(100):
+            try:
+                await client.get("/openapi.json")
+                return server, base_url
+            except TransportError:
+                await asyncio.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("uvicorn did not start")
+
+
+class Target:
+    """Creates clients of the app under test"""
+
+    def __init__(self, base_url: str, app=None):
+        self.base_url = base_url
+        self.app = app
+
+    def client(self, index: int, session_id: str | None = None) -> AsyncClient:
+        # session cookie is secure, set it by hand so it is sent over http too
+        cookies = {"session_id": session_id} if session_id else None
+        # every client gets its own address, auth is rate limited per address
+        address = f"10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}"
+        if self.app:
+            transport = ASGITransport(self.app, client=(address, 123))
+            headers = None
+        else:
+            transport = None
+            headers = {"X-Forwarded-For": address}
+        return AsyncClient(
+            transport=transport,
+            base_url=self.base_url,
+            cookies=cookies,
+            headers=headers,
+            timeout=60,
+        )
+
+
+async def seed_user(
+    target: Target, index: int, user: User, args: argparse.Namespace
+) -> None:
+    credentials = {"username": user.username, "password": PASSWORD}
+    async with target.client(index) as client:
+        response = await client.post("/v1/auth/register", json=credentials)
+        response.raise_for_status()
+        user.session_id = response.cookies["session_id"]
+
+    rng = random.Random(f"{args.seed}-{user.username}")
+    async with target.client(index, user.session_id) as client:
+        for i in range(args.activities):
+            response = await client.post(
+                "/v1/activities", json={"title": f"Activity {i}", "description": None}
+            )
+            response.raise_for_status()
+            activity_id = response.json()["activity_id"]
+            user.activity_ids.append(activity_id)
+            for month in range(1, args.months + 1):
+                days = [day for day in range(1, 29) if rng.random() < 0.5]
+                response = await client.patch(
+                    f"/v1/activities/{activity_id}/{YEAR}/{month}",
+                    json={"set_days": days, "clear_days": []},
+                )
+                response.raise_for_status()
+
+
+def scenarios(args: argparse.Namespace) -> dict[str, Request]:
+    rng = random.Random(args.seed)
+    registered = itertools.count()
+
+    def random_month() -> int:
+        return rng.randint(1, args.months)
+
+    async def register(client: AsyncClient, user: User, i: int) -> Response:
+        username = f"register{next(registered)}"
+        credentials = {"username": username, "password": PASSWORD}
+        return await client.post("/v1/auth/register", json=credentials)
+
+    async def login(client: AsyncClient, user: User, i: int) -> Response:
+        credentials = {"username": user.username, "password": PASSWORD}
+        return await client.post("/v1/auth/login", json=credentials)
+
+    async def list_activities(client: AsyncClient, user: User, i: int) -> Response:
+        return await client.get("/v1/activities")
+
+    async def create_activity(client: AsyncClient, user: User, i: int) -> Response:
+        activity = {"title": f"Created {i}", "description": None}
+        return await client.post("/v1/activities", json=activity)
+
+    async def read_history(client: AsyncClient, user: User, i: int) -> Response:
+        activity_id = rng.choice(user.activity_ids)
+        return await client.get(f"/v1/activities/{activity_id}/{YEAR}/{random_month()}")
+
+    async def toggle_history(client: AsyncClient, user: User, i: int) -> Response:
+        activity_id = rng.choice(user.activity_ids)
+        day = rng.randint(1, 28)
+        return await client.patch(
+            f"/v1/activities/{activity_id}/{YEAR}/{random_month()}/{day}"
+        )
+
+    return {
+        "register": register,
+        "login": login,
+        "list_activities": list_activities,
+        "create_activity": create_activity,
+        "read_history": read_history,
+        "toggle_history": toggle_history,
+    }
+
+
+async def run_scenario(
+    target: Target, users: list[User], request: Request, count: int, clients: int
+) -> dict[str, float]:
+    latencies: list[float] = []
+    errors = 0
+
+    async def run_client(index: int) -> None:
+        nonlocal errors
+        user = users[index % len(users)]
+        async with target.client(index, user.session_id) as client:
+            for i in range(count):
+                started = perf_counter()
+                response = await request(client, user, i)
+                latencies.append(perf_counter() - started)
+                if response.is_error:
+                    errors += 1
+
+    started = perf_counter()
+    await asyncio.gather(*(run_client(index) for index in range(clients)))
+    elapsed = perf_counter() - started
+
+    p = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(p[49] * 1000, 2),
+        "p95_ms": round(p[94] * 1000, 2),
+        "p99_ms": round(p[98] * 1000, 2),
+    }
+
+
+def find_regressions(
+    results: dict[str, dict[str, float]],
+    baseline: dict[str, dict[str, float]],
+    threshold: float,
+) -> list[str]:
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            regressions.append(
+                f"{name}: p95 {before['p95_ms']} ms -> {result['p95_ms']} ms"
+            )
+        if result["throughput"] < before["throughput"] * (1 - threshold):
+            regressions.append(
+                f"{name}: throughput {before['throughput']}"
+                f" -> {result['throughput']} req/s"
+            )
+        if result["errors"] > before["errors"]:
+            regressions.append(
+                f"{name}: errors {before['errors']} -> {result['errors']}"
+            )
+    return regressions
+
+
+async def main(args: argparse.Namespace) -> int:
+    server = None
+    if args.uvicorn:
+        server, base_url = await start_uvicorn()
+        target = Target(base_url)
+    else:
+        from src.main import app
+
+        await migrate_database()
+        target = Target("https://routina", app)
+
+    try:
+        users = [User(f"bench{i}") for i in range(args.users)]
+        started = perf_counter()
+        await asyncio.gather(
+            *(seed_user(target, index, user, args) for index, user in enumerate(users))
+        )
+        print(
+            f"seeded {args.users} users x {args.activities} activities"
+            f" x {args.months} months in {perf_counter() - started:.1f}s"
+        )
+
+        results: dict[str, dict[str, float]] = {}
+        print(
+            f"{'scenario':<16} {'requests':>9} {'errors':>7} {'req/s':>8}"
+            f" {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+        )
+        for name, request in scenarios(args).items():
+            count = (
+                args.auth_requests if name in ("register", "login") else args.requests
+            )
+            result = await run_scenario(target, users, request, count, args.clients)
+            results[name] = result
+            print(
+                f"{name:<16} {result['requests']:>9} {result['errors']:>7}"
+                f" {result['throughput']:>8.1f} {result['p50_ms']:>8.2f}"
+                f" {result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f}"
+            )
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+        else:
+            await dispose_engines()
+
+    if args.output:
+        config = {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("output", "baseline")
+        }
+        document = {"config": config, "scenarios": results}
+        args.output.write_text(json.dumps(document, indent=2, default=str))
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())["scenarios"]
+        regressions = find_regressions(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    # relative paths are given against the directory the command was run from
+    for name in ("output", "baseline"):
+        path = getattr(arguments, name)
+        if path:
+            setattr(arguments, name, CWD / path)
+    sys.exit(asyncio.run(main(arguments)))
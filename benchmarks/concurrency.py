@@ -0,0 +1,103 @@
+"""
+Measures API throughput with growing number of concurrent clients,
+and the longest time the event loop was blocked while serving them.
+
+A background thread keeps taking the database write lock for SLOW_WRITE
+seconds, the way a slow disk or a long transaction would. Requests that
+write have to wait for it, the others should not.
+
+Usage: python -m benchmarks.concurrency [requests per client]
+"""
+
+import asyncio
+import sqlite3
+import sys
+import threading
+from time import perf_counter, sleep
+
+from httpx import ASGITransport, AsyncClient
+
+from benchmarks import dispose_engines, migrate_database
+from src.main import app
+
+
+CLIENTS = (1, 2, 4, 8, 16)
+SLOW_WRITE = 0.05
+
+
+def hold_write_lock(stop: threading.Event) -> None:
+    connection = sqlite3.connect("database.db", isolation_level=None, timeout=30)
+    while not stop.is_set():
+        connection.execute("BEGIN IMMEDIATE")
+        sleep(SLOW_WRITE)
+        connection.execute("COMMIT")
+        sleep(SLOW_WRITE * 4)
+    connection.close()
+
+
+async def create_client(username: str) -> tuple[AsyncClient, str]:
+    client = AsyncClient(transport=ASGITransport(app), base_url="https://routina")
+    credentials = {"username": username, "password": "benchmark"}
+    response = await client.post("/v1/auth/register", json=credentials)
+    response.raise_for_status()
+    response = await client.post(
+        "/v1/activities", json={"title": "Benchmark", "description": None}
+    )
+    response.raise_for_status()
+    return client, response.json()["activity_id"]
+
+
+async def run_client(client: AsyncClient, activity_id: str, requests: int) -> None:
+    for i in range(requests):
+        if i % 5:
+            response = await client.get("/v1/activities")
+        else:
+            day = i % 28 + 1
+            response = await client.patch(f"/v1/activities/{activity_id}/2024/1/{day}")
+        response.raise_for_status()
+
+
+async def measure_loop_lag(lags: list[float]) -> None:
+    while True:
+        started = perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(perf_counter() - started - 0.001)
+
+
+async def main(requests: int) -> None:
+    await migrate_database()
+    clients = [await create_client(f"bench{i}") for i in range(max(CLIENTS))]
+
+    baseline: float | None = None
+    print(
+        f"{'clients':>8} {'requests':>9} {'seconds':>8} {'req/s':>8}"
+        f" {'scaling':>8} {'max loop lag ms':>16}"
+    )
+    for count in CLIENTS:
+        lags: list[float] = []
+        probe = asyncio.create_task(measure_loop_lag(lags))
+        stop = threading.Event()
+        writer = threading.Thread(target=hold_write_lock, args=(stop,))
+        writer.start()
+        started = perf_counter()
+        await asyncio.gather(
+            *(run_client(client, aid, requests) for client, aid in clients[:count])
+        )
+        elapsed = perf_counter() - started
+        probe.cancel()
+        stop.set()
+        writer.join()
+        throughput = count * requests / elapsed
+        baseline = baseline or throughput
+        print(
+            f"{count:>8} {count * requests:>9} {elapsed:>8.2f} {throughput:>8.0f}"
+            f" {throughput / baseline:>7.2f}x {max(lags) * 1000:>16.1f}"
+        )
+
+    for client, _ in clients:
+        await client.aclose()
+    await dispose_engines()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100))
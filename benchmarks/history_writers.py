@@ -0,0 +1,62 @@
+"""
+Checks that concurrent history writers do not lose updates.
+Every client changes a different day of the same month at the same time,
+in the end each change has to be visible.
+
+Usage: python -m benchmarks.history_writers [rounds]
+"""
+
+import asyncio
+import sys
+from calendar import monthrange
+from time import perf_counter
+
+from httpx import ASGITransport, AsyncClient
+
+from benchmarks import dispose_engines, migrate_database
+from src.main import app
+
+
+YEAR = 2020
+
+
+async def main(rounds: int) -> None:
+    await migrate_database()
+    client = AsyncClient(transport=ASGITransport(app), base_url="https://routina")
+    credentials = {"username": "writers", "password": "benchmark"}
+    (await client.post("/v1/auth/register", json=credentials)).raise_for_status()
+    response = await client.post("/v1/activities", json={"title": "Writers"})
+    activity_id = response.json()["activity_id"]
+
+    lost = 0
+    started = perf_counter()
+    for month in range(1, rounds + 1):
+        url = f"/v1/activities/{activity_id}/{YEAR}/{month}"
+        # days past the end of month are rejected
+        days = range(1, monthrange(YEAR, month)[1] + 1)
+        # toggle each day once, then set and clear halves of the month
+        await asyncio.gather(*(client.patch(f"{url}/{day}") for day in days))
+        toggled = (await client.get(url)).json()
+        await asyncio.gather(
+            *(
+                client.patch(
+                    url, json={"clear_days": [day]} if day % 2 else {"set_days": [day]}
+                )
+                for day in days
+            )
+        )
+        updated = (await client.get(url)).json()
+        lost += len(days) - len(toggled)
+        lost += len(set(updated) ^ {day for day in days if day % 2 == 0})
+    elapsed = perf_counter() - started
+
+    writes = sum(monthrange(YEAR, month)[1] for month in range(1, rounds + 1)) * 2
+    print(f"{writes} concurrent writes in {elapsed:.2f}s, {lost} lost updates")
+    await client.aclose()
+    await dispose_engines()
+    if lost:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 12))
@@ -0,0 +1,57 @@
+"""
+Measures requests per second of a minimal endpoint with and without
+ValidateSession middleware, the session being already cached.
+
+Usage: python -m benchmarks.middleware [requests]
+"""
+
+import asyncio
+import sys
+from time import perf_counter
+
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+
+from src.cache import session_cache
+from src.middlewares import ValidateSession
+from src.utils import create_session_id, create_uuid_v4, unix_time
+
+
+def create_app(middleware: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping() -> None:
+        return None
+
+    if middleware:
+        app.add_middleware(ValidateSession)
+    return app
+
+
+async def measure(app: FastAPI, session_id: str, requests: int) -> float:
+    async with AsyncClient(
+        transport=ASGITransport(app),
+        base_url="https://routina",
+        cookies={"session_id": session_id},
+    ) as client:
+        started = perf_counter()
+        for _ in range(requests):
+            response = await client.get("/ping")
+            response.raise_for_status()
+        return requests / (perf_counter() - started)
+
+
+async def main(requests: int) -> None:
+    session_id = create_session_id()
+    session_cache.set(session_id, create_uuid_v4(), unix_time() + 3600)
+
+    plain = await measure(create_app(False), session_id, requests)
+    validated = await measure(create_app(True), session_id, requests)
+    print(f"{'without middleware':<20} {plain:>8.0f} req/s")
+    print(f"{'ValidateSession':<20} {validated:>8.0f} req/s")
+    print(f"{'overhead':<20} {(1 / validated - 1 / plain) * 1e6:>8.0f} us/request")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000))
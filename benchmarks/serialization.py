@@ -0,0 +1,121 @@
+"""
+Measures GET /v1/activities of a user with thousands of activities,
+and the cost of serializing them the way FastAPI does with response_model
+and JSONResponse compared to plain rows and ORJSONResponse.
+
+Usage: python -m benchmarks.serialization [activities] [requests]
+"""
+
+import asyncio
+import sys
+from time import perf_counter
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from httpx import ASGITransport, AsyncClient
+from pydantic import TypeAdapter
+from sqlmodel import insert, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from benchmarks import dispose_engines, migrate_database
+from src.database import Activities, Sessions, engine, read_engine
+from src.main import app
+from src.models.activity import ActivityOut
+from src.utils import create_uuid_v4, unix_time
+
+
+async def seed(activities: int) -> None:
+    async with AsyncClient(
+        transport=ASGITransport(app), base_url="https://routina"
+    ) as client:
+        credentials = {"username": "serialization", "password": "benchmark"}
+        response = await client.post("/v1/auth/register", json=credentials)
+        response.raise_for_status()
+
+    async with AsyncSession(engine) as session:
+        user_id = (await session.exec(select(Sessions.user_id))).one()
+        await session.exec(
+            insert(Activities),
+            params=[
+                {
+                    "activity_id": create_uuid_v4(),
+                    "user_id": user_id,
+                    "title": f"Activity {i % 1000}",
+                    "description": "Benchmark activity description",
+                    "created_at": unix_time(),
+                    "ended_at": None if i % 3 else unix_time(),
+                }
+                for i in range(activities)
+            ],
+        )
+        await session.commit()
+
+
+async def measure_endpoint(requests: int) -> float:
+    async with AsyncSession(engine) as session:
+        session_id = (await session.exec(select(Sessions.session_id))).one()
+    async with AsyncClient(
+        transport=ASGITransport(app),
+        base_url="https://routina",
+        cookies={"session_id": session_id},
+    ) as client:
+        (await client.get("/v1/activities")).raise_for_status()
+        started = perf_counter()
+        for _ in range(requests):
+            (await client.get("/v1/activities")).raise_for_status()
+    return (perf_counter() - started) / requests
+
+
+async def measure_serialization(requests: int) -> tuple[float, float]:
+    async with AsyncSession(read_engine) as session:
+        entries = (await session.exec(select(Activities))).all()
+        rows = [
+            dict(row)
+            for row in (
+                await session.exec(
+                    select(
+                        Activities.title,
+                        Activities.description,
+                        Activities.activity_id,
+                        Activities.created_at,
+                        Activities.ended_at,
+                    )
+                )
+            ).mappings()
+        ]
+
+    # what FastAPI does with ORM entries and a response_model
+    adapter = TypeAdapter(list[ActivityOut])
+    started = perf_counter()
+    for _ in range(requests):
+        validated = adapter.validate_python(entries, from_attributes=True)
+        JSONResponse(adapter.dump_python(validated, mode="json"))
+    validated_time = (perf_counter() - started) / requests
+
+    started = perf_counter()
+    for _ in range(requests):
+        ORJSONResponse(rows)
+    direct_time = (perf_counter() - started) / requests
+    return validated_time, direct_time
+
+
+async def main(activities: int, requests: int) -> None:
+    await migrate_database()
+    await seed(activities)
+
+    endpoint = await measure_endpoint(requests)
+    validated, direct = await measure_serialization(requests)
+    print(f"GET /v1/activities with {activities} activities: {endpoint * 1000:.1f} ms")
+    print(f"response_model + JSONResponse: {validated * 1000:.1f} ms")
+    print(f"rows + ORJSONResponse:         {direct * 1000:.1f} ms")
+    print(f"speedup: {validated / direct:.1f}x")
+
+    await dispose_engines()
+
+
+if __name__ == "__main__":
+    asyncio.run(
+        main(
+            int(sys.argv[1]) if len(sys.argv) > 1 else 5000,
+            int(sys.argv[2]) if len(sys.argv) > 2 else 20,
+        )
+    )
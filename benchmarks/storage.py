@@ -0,0 +1,196 @@
+"""
+Compares monthly history rows with packed yearly ones:
+size of histories with their indexes, time to migrate,
+and latency of reading a year and a month of one activity.
+
+Usage: python -m benchmarks.storage [activities] [years] [reads]
+"""
+
+import asyncio
+import random
+import shutil
+import sqlite3
+import sys
+from time import perf_counter
+from typing import Callable
+
+from sqlalchemy import create_engine
+from sqlmodel import SQLModel
+
+from benchmarks import dispose_engines, migrate_database
+from src.crud import month_histories
+from src.history import decode_days
+from src.utils import create_uuid_v4, unix_time
+
+
+YEAR = 2020
+Query = tuple[str, Callable[[tuple, list[tuple]], list[dict]]]
+# histories before they were packed, schema version 2
+MONTHLY_HISTORIES = (
+    "CREATE TABLE histories (history_id CHAR(32) NOT NULL,"
+    " activity_id CHAR(32) NOT NULL, year INTEGER NOT NULL, month INTEGER NOT NULL,"
+    " days INTEGER NOT NULL, PRIMARY KEY (history_id),"
+    " FOREIGN KEY(activity_id) REFERENCES activities (activity_id) ON DELETE CASCADE)",
+    "CREATE INDEX ix_histories_history_id ON histories (history_id)",
+    "CREATE UNIQUE INDEX ix_histories_activity_id_year_month"
+    " ON histories (activity_id, year, month)",
+)
+
+
+def create_monthly(activities: int, years: int) -> list[str]:
+    """Creates database with monthly histories, returns activity IDs"""
+    sync_engine = create_engine("sqlite:///database.db")
+    SQLModel.metadata.create_all(sync_engine)
+    sync_engine.dispose()
+
+    rng = random.Random(0)
+    user_id = create_uuid_v4().hex
+    activity_ids = [create_uuid_v4().hex for _ in range(activities)]
+    db = sqlite3.connect("database.db")
+    # columns added after version 2
+    db.execute("ALTER TABLE users DROP COLUMN data_version")
+    db.execute("DROP TABLE histories")
+    for statement in MONTHLY_HISTORIES:
+        db.execute(statement)
+    db.execute("PRAGMA user_version = 2")
+    db.execute(
+        "INSERT INTO users (user_id, username, password, created_at)"
+        " VALUES (?, 'storage', '', ?)",
+        (user_id, unix_time()),
+    )
+    db.executemany(
+        "INSERT INTO activities VALUES (?, ?, 'Activity', NULL, ?, NULL)",
+        [(activity_id, user_id, unix_time()) for activity_id in activity_ids],
+    )
+    db.executemany(
+        "INSERT INTO histories VALUES (?, ?, ?, ?, ?)",
+        (
+            (create_uuid_v4().hex, activity_id, year, month, rng.getrandbits(28))
+            for activity_id in activity_ids
+            for year in range(YEAR - years + 1, YEAR + 1)
+            for month in range(1, 13)
+        ),
+    )
+    db.commit()
+    db.close()
+    return activity_ids
+
+
+def histories_size(path: str) -> tuple[int, int]:
+    """Returns rows and bytes of pages used by histories and its indexes"""
+    db = sqlite3.connect(path)
+    db.execute("VACUUM")
+    rows = db.execute("SELECT count(*) FROM histories").fetchone()[0]
+    size = db.execute(
+        "SELECT sum(pgsize) FROM dbstat WHERE name IN"
+        " (SELECT name FROM sqlite_master WHERE tbl_name = 'histories')"
+    ).fetchone()[0]
+    db.close()
+    return rows, size
+
+
+def measure_reads(
+    path: str, queries: dict[str, Query], keys: list[tuple]
+) -> dict[str, float]:
+    """Returns mean seconds of every query with its decoding, over keys"""
+    db = sqlite3.connect(path)
+    timings = {}
+    for name, (query, decode) in queries.items():
+        started = perf_counter()
+        for key in keys:
+            decode(key, db.execute(query, key[: query.count("?")]).fetchall())
+        timings[name] = (perf_counter() - started) / len(keys)
+    db.close()
+    return timings
+
+
+def monthly_queries() -> dict[str, Query]:
+    def decode(key: tuple, rows: list[tuple]) -> list[dict]:
+        activity_id, year = key[:2]
+        return [
+            {
+                "activity_id": activity_id,
+                "year": year,
+                "month": month,
+                "days": decode_days(days),
+            }
+            for month, days in rows
+            if days
+        ]
+
+    return {
+        "year": (
+            "SELECT month, days FROM histories"
+            " WHERE activity_id = ? AND year = ? ORDER BY month",
+            decode,
+        ),
+        "month": (
+            "SELECT month, days FROM histories"
+            " WHERE activity_id = ? AND year = ? AND month = ?",
+            decode,
+        ),
+    }
+
+
+def yearly_queries() -> dict[str, Query]:
+    def decode(key: tuple, rows: list[tuple]) -> list[dict]:
+        activity_id, year, month = (key + (None,))[:3]
+        return month_histories(activity_id, year, rows[0][0], month) if rows else []
+
+    query = "SELECT days FROM histories WHERE activity_id = ? AND year = ?"
+    return {
+        "year": (query, lambda key, rows: decode(key[:2], rows)),
+        "month": (query, decode),
+    }
+
+
+async def main(activities: int, years: int, reads: int) -> None:
+    activity_ids = create_monthly(activities, years)
+    shutil.copy("database.db", "monthly.db")
+
+    started = perf_counter()
+    await migrate_database()
+    migrated = perf_counter() - started
+    await dispose_engines()
+
+    rng = random.Random(1)
+    keys = [
+        (
+            rng.choice(activity_ids),
+            rng.randint(YEAR - years + 1, YEAR),
+            rng.randint(1, 12),
+        )
+        for _ in range(reads)
+    ]
+    results = {
+        "monthly": (
+            histories_size("monthly.db"),
+            measure_reads("monthly.db", monthly_queries(), keys),
+        ),
+        "yearly": (
+            histories_size("database.db"),
+            measure_reads("database.db", yearly_queries(), keys),
+        ),
+    }
+
+    print(f"{activities} activities x {years} years, migrated in {migrated:.2f}s")
+    print(
+        f"{'format':<8} {'rows':>8} {'KiB':>6} {'B/year':>7}"
+        f" {'year us':>8} {'month us':>9}"
+    )
+    for name, ((rows, size), timings) in results.items():
+        per_year = size / (activities * years)
+        print(
+            f"{name:<8} {rows:>8} {size / 1024:>6.0f} {per_year:>7.0f}"
+            f" {timings['year'] * 1e6:>8.1f} {timings['month'] * 1e6:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(
+        main(
+            int(sys.argv[1]) if len(sys.argv) > 1 else 2000,
+            int(sys.argv[2]) if len(sys.argv) > 2 else 3,
+            int(sys.argv[3]) if len(sys.argv) > 3 else 5000,
+        )
+    )
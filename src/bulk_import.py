@@ -0,0 +1,126 @@
+from typing import Any, AsyncIterator
+from uuid import UUID
+
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import insert
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from .database import engine, Activities, Histories
+from .crud import UserNotFound, bump_data_version
+from .events import activities_imported, event_broker
+from .models.activity import ActivityImport, ActivityImportError, ActivityImportOut
+from .history import encode_dates, pack_year
+from .utils import create_uuid_v4, unix_time
+from .config import IMPORT_CHUNK_SIZE, IMPORT_MAX_LINE_SIZE, IMPORT_MAX_ERRORS
+
+
+async def split_lines(
+    chunks: AsyncIterator[bytes], max_line_size: int = IMPORT_MAX_LINE_SIZE
+) -> AsyncIterator[bytes | None]:
+    """
+    Yields lines of streamed body without line endings,
+    or None for lines longer than max_line_size which are not kept in memory.
+    """
+    buffer = b""
+    too_long = False
+    async for chunk in chunks:
+        lines = (buffer + chunk).split(b"\n")
+        buffer = lines.pop()
+        for line in lines:
+            yield None if too_long or len(line) > max_line_size else line
+            too_long = False
+        # drop the start of a long line, it is reported once it ends
+        if len(buffer) > max_line_size:
+            buffer = b""
+            too_long = True
+    if buffer or too_long:
+        yield None if too_long or len(buffer) > max_line_size else buffer
+
+
+def activity_rows(
+    user_id: UUID, record: ActivityImport
+) -> tuple[dict[str, Any], list[dict[str, Any]]]:
+    """Returns activity row of record and its days merged into year bitmap rows"""
+    activity_id = create_uuid_v4()
+    activity = {
+        "activity_id": activity_id,
+        "user_id": user_id,
+        "title": record.title,
+        "description": record.description,
+        "created_at": record.created_at or unix_time(),
+        "ended_at": record.ended_at,
+    }
+    histories = [
+        {"activity_id": activity_id, "year": year, "days": pack_year(days)}
+        for year, days in encode_dates(record.days).items()
+    ]
+    return activity, histories
+
+
+async def insert_activities(
+    user_id: UUID, activities: list[dict[str, Any]], histories: list[dict[str, Any]]
+) -> None:
+    """Inserts activity rows with their history rows in one transaction"""
+    async with AsyncSession(engine) as session:
+        try:
+            await session.exec(insert(Activities), params=activities)
+        except IntegrityError:
+            raise UserNotFound()
+        if histories:
+            await session.exec(insert(Histories), params=histories)
+        version = await bump_data_version(session, user_id)
+        await session.commit()
+    event_broker.publish(user_id, version, activities_imported(len(activities)))
+
+
+async def import_ndjson(
+    user_id: UUID, chunks: AsyncIterator[bytes]
+) -> ActivityImportOut:
+    """
+    Imports one activity per line of NDJSON body, in chunks of IMPORT_CHUNK_SIZE.
+    Invalid lines are reported and skipped, blank lines are ignored.
+    """
+    result = ActivityImportOut(imported=0, failed=0, errors=[])
+
+    def reject(line: int, errors: list[str]) -> None:
+        result.failed += 1
+        if len(result.errors) < IMPORT_MAX_ERRORS:
+            result.errors.append(ActivityImportError(line=line, errors=errors))
+
+    # rows of validated lines, kept instead of their records: a year of days
+    # takes a 46 byte bitmap here rather than hundreds of date objects
+    activities: list[dict[str, Any]] = []
+    histories: list[dict[str, Any]] = []
+    line_number = 0
+    async for line in split_lines(chunks):
+        line_number += 1
+        if line is None:
+            reject(line_number, [f"Line is longer than {IMPORT_MAX_LINE_SIZE} bytes"])
+            continue
+        if not line.strip():
+            continue
+        try:
+            record = ActivityImport.model_validate_json(line)
+        except ValidationError as error:
+            reject(
+                line_number,
+                [
+                    f"{'.'.join(map(str, detail['loc'])) or 'line'}: {detail['msg']}"
+                    for detail in error.errors()
+                ],
+            )
+            continue
+        activity, activity_histories = activity_rows(user_id, record)
+        activities.append(activity)
+        histories.extend(activity_histories)
+        if len(activities) >= IMPORT_CHUNK_SIZE:
+            await insert_activities(user_id, activities, histories)
+            result.imported += len(activities)
+            activities = []
+            histories = []
+
+    if activities:
+        await insert_activities(user_id, activities, histories)
+        result.imported += len(activities)
+    return result
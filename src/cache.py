@@ -0,0 +1,62 @@
+from collections import OrderedDict
+from typing import Any, Hashable
+from uuid import UUID
+
+from .config import (
+    SESSION_CACHE_SIZE,
+    SESSION_CACHE_TTL,
+    STATS_CACHE_SIZE,
+    STATS_CACHE_TTL,
+)
+from .utils import unix_time
+
+
+class TTLCache:
+    """Bounded LRU cache, entries expire after ttl seconds or at given unix time"""
+
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if unix_time() >= expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, expires_at: int | None = None) -> None:
+        deadline = unix_time() + self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        self._entries[key] = (value, deadline)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+class SessionCache(TTLCache):
+    """Maps session ID to user ID of sessions validated against the database"""
+
+    def invalidate_user(self, user_id: UUID) -> None:
+        stale = [key for key, (value, _) in self._entries.items() if value == user_id]
+        for key in stale:
+            del self._entries[key]
+
+
+session_cache = SessionCache(SESSION_CACHE_SIZE, SESSION_CACHE_TTL)
+stats_cache = TTLCache(STATS_CACHE_SIZE, STATS_CACHE_TTL)
@@ -1,5 +1,32 @@
-DATABASE_URL: str = "sqlite:///database.db"
-DATABASE_ECHO: bool = True  # prints sql queries,
+DATABASE_URL: str = "sqlite+aiosqlite:///database.db"
+DATABASE_ECHO: bool = False  # prints sql queries, use metrics to measure them
+
+# pragmas applied to every new sqlite connection
+# WAL lets readers work while a write is in progress, also across worker processes
+# synchronous NORMAL is durable with WAL except for the last commits on power loss,
+# it syncs on checkpoints instead of every commit
+# busy_timeout (milliseconds) is how long a writer waits for the lock before failing
+# cache_size is per connection, negative values are KiB
+DATABASE_PRAGMAS: dict[str, str | int] = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "cache_size": -16000,
+    "mmap_size": 128 * 1024 * 1024,
+    # deleting a user deletes its sessions, activities and histories
+    "foreign_keys": "ON",
+}
+
+# connection pools of each worker process
+# sqlite takes one writer at a time, more write connections would only wait
+# for its lock polling through busy_timeout, writers queue for the one
+# connection instead, in order
+# reads use a separate pool of read only connections
+DATABASE_POOL_SIZE: int = 1
+DATABASE_MAX_OVERFLOW: int = 0
+DATABASE_READ_POOL_SIZE: int = 8
+DATABASE_READ_MAX_OVERFLOW: int = 8
+DATABASE_POOL_TIMEOUT: int = 30  # seconds
 
 # how long should session last in seconds
 # 30 days = 30 * 24 * 60 * 60 = 2592000 seconds
@@ -7,3 +34,77 @@ SESSION_DURATION: int = 2592000
 
 # Disable /docs by setting it to None
 DOCS_URL: str | None = "/docs"
+
+# per route request counts, latency and SQL queries in Prometheus text format
+# Disable /metrics by setting it to None, it is not protected by session
+METRICS_URL: str | None = "/metrics"
+# reports SQL queries and time of each request in Server-Timing response header
+METRICS_SERVER_TIMING: bool = False
+
+# validated sessions are cached in memory of each worker
+# logout or user deletion reaches other workers after at most SESSION_CACHE_TTL seconds
+SESSION_CACHE_SIZE: int = 10000
+SESSION_CACHE_TTL: int = 60
+
+# argon2 hashing runs in a pool so it does not block the event loop
+# "thread" is enough as argon2 releases the GIL, "process" isolates it completely
+PASSWORD_HASHER_POOL: str = "thread"
+PASSWORD_HASHER_WORKERS: int = 2
+# hashing jobs allowed to wait for a free worker, more are rejected with 503
+PASSWORD_HASHER_QUEUE_SIZE: int = 16
+PASSWORD_HASHER_RETRY_AFTER: int = 1  # seconds
+
+# argon2id parameters of new hashes, older hashes are rehashed on login
+# pick them per machine with: python -m src.crypto --latency 0.05 --memory 65536
+PASSWORD_HASHER_MEMORY_COST: int = 19456  # KiB
+PASSWORD_HASHER_TIME_COST: int = 2
+PASSWORD_HASHER_PARALLELISM: int = 1
+# calibrate memory and time cost on startup instead of using the values above
+# every worker calibrates on its own, prefer the command above with several workers
+PASSWORD_HASHER_CALIBRATE: bool = False
+PASSWORD_HASHER_TARGET_LATENCY: float = 0.05  # seconds per hash
+PASSWORD_HASHER_MAX_MEMORY_COST: int = 65536  # KiB per hash
+
+# login and register attempts are limited before any password hashing
+# a client may burst BURST attempts, then RATE attempts per second
+# client address is the peer address, run uvicorn with --proxy-headers behind a proxy
+AUTH_RATE_LIMIT_ADDRESS_RATE: float = 1.0
+AUTH_RATE_LIMIT_ADDRESS_BURST: int = 20
+# login attempts to one username, one every 10 seconds after a burst of 10
+AUTH_RATE_LIMIT_USERNAME_RATE: float = 0.1
+AUTH_RATE_LIMIT_USERNAME_BURST: int = 10
+# clients tracked by each limiter, least recently seen ones are forgotten
+AUTH_RATE_LIMIT_MAX_KEYS: int = 100000
+
+# statistics of each activity since its creation are cached with user's data version,
+# any write of the user through any worker makes them stale
+STATS_CACHE_SIZE: int = 10000
+STATS_CACHE_TTL: int = 3600
+
+# user data export reads this many activities with their histories per transaction
+EXPORT_CHUNK_SIZE: int = 500
+
+# bulk import writes this many activities with their histories per transaction
+IMPORT_CHUNK_SIZE: int = 500
+IMPORT_MAX_LINE_SIZE: int = 1024 * 1024  # bytes
+IMPORT_MAX_ERRORS: int = 100  # reported in response, the rest is only counted
+
+# rows of one page of activities or sessions, lists without a limit return every row
+LIST_MAX_LIMIT: int = 1000
+
+# operations of one /v1/batch request, all run in a single transaction
+BATCH_MAX_OPERATIONS: int = 500
+
+# live changes streamed by /v1/events, kept in memory of each worker process
+# a stream more than EVENTS_QUEUE_SIZE commits behind is closed, its client reconnects
+EVENTS_QUEUE_SIZE: int = 100
+EVENTS_MAX_STREAMS: int = 10  # per user
+EVENTS_HEARTBEAT: int = 15  # seconds between keep-alive comments
+# streams end after this many seconds, reconnecting checks the session again
+EVENTS_MAX_DURATION: int = 3600
+
+# expired sessions are deleted in the background every SESSION_SWEEP_INTERVAL seconds
+# in batches, waiting up to SESSION_SWEEP_MAX_BACKOFF seconds while database is busy
+SESSION_SWEEP_INTERVAL: int = 3600
+SESSION_SWEEP_BATCH_SIZE: int = 500
+SESSION_SWEEP_MAX_BACKOFF: int = 6 * 3600
@@ -0,0 +1,366 @@
+from calendar import monthrange
+from collections.abc import Iterable
+from datetime import date
+from typing import Any
+from uuid import UUID
+
+from fastapi import HTTPException, status
+from sqlalchemy import (
+    ColumnElement,
+    LargeBinary,
+    String,
+    and_,
+    literal,
+    tuple_,
+    type_coerce,
+)
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import SQLModel, delete, func, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from .database import Users, Activities, Histories
+from .models.activity import ActivityIn, ActivityUpdate
+from .models.history import HistoryUpdate
+from .history import (
+    count_days,
+    decode_days,
+    decode_month,
+    encode_days,
+    encode_month,
+    pack_year,
+    split_months,
+    unpack_year,
+)
+from .utils import create_uuid_v4, unix_time
+
+
+class UserNotFound(Exception):
+    """Raised when a write finds no user, deleted while its session was cached"""
+
+
+async def bump_data_version(session: AsyncSession, user_id: UUID) -> int:
+    """
+    Changes ETag of user's data, run in the transaction changing the data.
+    Returns the new data version, raises UserNotFound when user is gone.
+    """
+    statement = (
+        update(Users)
+        .where(Users.user_id == user_id)
+        .values(data_version=Users.data_version + 1)
+        .returning(Users.data_version)
+    )
+    version = (await session.exec(statement)).scalar_one_or_none()
+    if version is None:
+        raise UserNotFound()
+    return version
+
+
+async def select_page(
+    session: AsyncSession,
+    model: type[SQLModel],
+    key: str,
+    fields: list[str],
+    where: list[ColumnElement[bool]],
+    created_after: int | None = None,
+    created_before: int | None = None,
+    after: tuple[int, str] | None = None,
+    limit: int | None = None,
+) -> tuple[list[dict[str, Any]], tuple[int, Any] | None]:
+    """
+    Returns fields of rows ordered by creation time and key,
+    starting after position of the previous page when given, and
+    position of the last row when limit left more rows for the next page.
+    Model has an index on (user_id, created_at, key) for this order.
+    """
+    created_at, key_column = model.created_at, getattr(model, key)
+    columns = list(dict.fromkeys([*fields, "created_at", key]))
+    statement = select(*(getattr(model, name) for name in columns)).where(*where)
+    if created_after is not None:
+        statement = statement.where(created_at > created_after)
+    if created_before is not None:
+        statement = statement.where(created_at < created_before)
+    if after is not None:
+        # compared as stored text, a forged cursor can not fail binding a UUID
+        statement = statement.where(
+            tuple_(created_at, type_coerce(key_column, String)) > tuple_(*after)
+        )
+    statement = statement.order_by(created_at, key_column)
+    if limit is not None:
+        # one more row tells whether there is a next page
+        statement = statement.limit(limit + 1)
+    rows = (await session.exec(statement)).mappings().all()
+
+    position = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        position = (rows[-1]["created_at"], rows[-1][key])
+    return [{name: row[name] for name in fields} for row in rows], position
+
+
+async def check_activity(
+    session: AsyncSession, user_id: UUID, activity_id: UUID
+) -> None:
+    """
+    Raises error unless activity exists and belongs to user.
+    Statements below are limited to user's activities, this tells
+    why one of them matched nothing.
+    """
+    statement = select(Activities.user_id).where(Activities.activity_id == activity_id)
+    owner = (await session.exec(statement)).first()
+    if owner is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Activity not found")
+    if owner != user_id:
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="Unathorized")
+
+
+async def create_activity(
+    session: AsyncSession, user_id: UUID, activity_in: ActivityIn
+) -> Activities:
+    """Adds new activity of user, flushed so following statements can use it"""
+    activity = Activities(
+        activity_id=create_uuid_v4(),
+        user_id=user_id,
+        title=activity_in.title,
+        description=activity_in.description,
+        created_at=unix_time(),
+        ended_at=None,
+    )
+    session.add(activity)
+    try:
+        await session.flush()
+    except IntegrityError:
+        # only the user foreign key can fail, the activity ID is new
+        raise UserNotFound()
+    return activity
+
+
+def activity_values(activity_update: ActivityUpdate) -> dict[str, Any]:
+    """Returns columns changed by activity update"""
+    values = {}
+    if activity_update.title:
+        values["title"] = activity_update.title
+    if activity_update.description:
+        values["description"] = activity_update.description
+    if activity_update.end:
+        if activity_update.end is True:
+            values["ended_at"] = unix_time()
+    return values
+
+
+async def update_activity(
+    session: AsyncSession, user_id: UUID, activity_id: UUID, values: dict[str, Any]
+) -> bool:
+    """Updates user's activity, returns whether it was found"""
+    if not values:
+        await check_activity(session, user_id, activity_id)
+        return True
+    statement = (
+        update(Activities)
+        .where(Activities.activity_id == activity_id, Activities.user_id == user_id)
+        .values(values)
+    )
+    return (await session.exec(statement)).rowcount == 1
+
+
+async def delete_activity(
+    session: AsyncSession, user_id: UUID, activity_id: UUID
+) -> bool:
+    """Deletes user's activity, returns whether it was found"""
+    statement = delete(Activities).where(
+        Activities.activity_id == activity_id, Activities.user_id == user_id
+    )
+    return (await session.exec(statement)).rowcount == 1
+
+
+async def upsert_history(
+    session: AsyncSession,
+    user_id: UUID,
+    activity_id: UUID,
+    year: int,
+    days: bytes,
+    updated_days: ColumnElement[bytes],
+) -> bool:
+    """
+    Inserts year history of user's activity with given packed days,
+    or sets existing days to updated_days in the same statement.
+    Returns whether the activity was found.
+    """
+    owned_activity = select(
+        Activities.activity_id, literal(year), literal(days, LargeBinary)
+    ).where(Activities.activity_id == activity_id, Activities.user_id == user_id)
+    statement = (
+        insert(Histories)
+        .from_select(["activity_id", "year", "days"], owned_activity)
+        .on_conflict_do_update(
+            index_elements=["activity_id", "year"], set_={"days": updated_days}
+        )
+    )
+    return (await session.exec(statement)).rowcount == 1
+
+
+def check_month_days(year: int, month: int, days: Iterable[int]) -> None:
+    """Raises error for days past the end of month, histories can not store them"""
+    length = monthrange(year, month)[1]
+    past = [day for day in days if day > length]
+    if past:
+        raise HTTPException(
+            status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Day {min(past)} is past the end of {year}-{month:02}",
+        )
+
+
+async def toggle_history_day(
+    session: AsyncSession,
+    user_id: UUID,
+    activity_id: UUID,
+    year: int,
+    month: int,
+    day: int,
+) -> bool:
+    """Toggles day in user's activity history, returns whether it was found"""
+    check_month_days(year, month, (day,))
+    days = pack_year(encode_month(year, month, 1 << day - 1))
+    return await upsert_history(
+        session,
+        user_id,
+        activity_id,
+        year,
+        days,
+        func.history_toggle(Histories.days, days, type_=LargeBinary),
+    )
+
+
+async def update_history_days(
+    session: AsyncSession,
+    user_id: UUID,
+    activity_id: UUID,
+    year: int,
+    month: int,
+    history_update: HistoryUpdate,
+) -> bool:
+    """
+    Sets and clears days in user's activity history,
+    returns whether it was found.
+    """
+    check_month_days(year, month, history_update.set_days | history_update.clear_days)
+    if not history_update.set_days and not history_update.clear_days:
+        await check_activity(session, user_id, activity_id)
+        return True
+    set_mask = pack_year(
+        encode_month(year, month, encode_days(history_update.set_days))
+    )
+    clear_mask = pack_year(
+        encode_month(year, month, encode_days(history_update.clear_days))
+    )
+    return await upsert_history(
+        session,
+        user_id,
+        activity_id,
+        year,
+        set_mask,
+        func.history_update(Histories.days, set_mask, clear_mask, type_=LargeBinary),
+    )
+
+
+def month_histories(
+    activity_id: UUID, year: int, days: bytes, month: int | None = None
+) -> list[dict]:
+    """Returns non-empty months of packed year days as dicts shaped like HistoryOut"""
+    bitmap = unpack_year(days)
+    if month is None:
+        months = split_months(year, bitmap)
+    else:
+        months = [(month, decode_month(year, month, bitmap))]
+    return [
+        {
+            "activity_id": activity_id,
+            "year": year,
+            "month": month,
+            "days": decode_days(month_days),
+        }
+        for month, month_days in months
+        if month_days
+    ]
+
+
+async def select_histories(
+    session: AsyncSession,
+    user_id: UUID,
+    year: int,
+    month: int | None = None,
+    activity_ids: list[UUID] | None = None,
+) -> list[dict]:
+    """
+    Returns non-empty histories of user's activities in one query,
+    as dicts shaped like HistoryOut.
+    """
+    statement = (
+        select(Histories.activity_id, Histories.days)
+        .join(Activities, Activities.activity_id == Histories.activity_id)
+        .where(Activities.user_id == user_id, Histories.year == year)
+        .order_by(Histories.activity_id)
+    )
+    if activity_ids is not None:
+        statement = statement.where(Histories.activity_id.in_(activity_ids))
+
+    return [
+        history
+        for activity_id, days in await session.exec(statement)
+        for history in month_histories(activity_id, year, days, month)
+    ]
+
+
+async def select_activity_histories(
+    session: AsyncSession,
+    user_id: UUID,
+    activity_id: UUID,
+    year: int,
+    month: int | None = None,
+) -> list[dict]:
+    """
+    Returns non-empty histories of user's activity like select_histories,
+    raises error when activity is missing or someone else's.
+    The activity is read together with its history in one query.
+    """
+    statement = (
+        select(Activities.user_id, Histories.days)
+        .outerjoin(
+            Histories,
+            and_(
+                Histories.activity_id == Activities.activity_id,
+                Histories.year == year,
+            ),
+        )
+        .where(Activities.activity_id == activity_id)
+    )
+    row = (await session.exec(statement)).first()
+    if row is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Activity not found")
+    if row.user_id != user_id:
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="Unathorized")
+
+    return month_histories(activity_id, year, row.days, month)
+
+
+async def select_heatmap(
+    session: AsyncSession,
+    user_id: UUID,
+    year: int,
+    activity_ids: list[UUID] | None = None,
+) -> dict:
+    """
+    Returns number of user's activities done on every day of year
+    as dict shaped like HeatmapOut, from all their histories read in one query.
+    """
+    statement = (
+        select(Histories.days)
+        .join(Activities, Activities.activity_id == Histories.activity_id)
+        .where(Activities.user_id == user_id, Histories.year == year)
+    )
+    if activity_ids is not None:
+        statement = statement.where(Histories.activity_id.in_(activity_ids))
+
+    length = (date(year + 1, 1, 1) - date(year, 1, 1)).days
+    bitmaps = (unpack_year(days) for days in await session.exec(statement))
+    return {"year": year, "days": count_days(bitmaps, length)}
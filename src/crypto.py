@@ -1,17 +1,180 @@
+"""
+Password hashing with argon2id.
+
+Pick parameters for this machine: python -m src.crypto --latency 0.05 --memory 65536
+"""
+
+import argparse
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from time import perf_counter
+from typing import Any, Callable
+
 from argon2 import PasswordHasher
-from argon2.exceptions import Argon2Error
+from argon2.exceptions import Argon2Error, InvalidHashError
+
+from .config import (
+    PASSWORD_HASHER_POOL,
+    PASSWORD_HASHER_WORKERS,
+    PASSWORD_HASHER_QUEUE_SIZE,
+    PASSWORD_HASHER_MEMORY_COST,
+    PASSWORD_HASHER_TIME_COST,
+    PASSWORD_HASHER_PARALLELISM,
+)
+
+
+# OWASP minimum, with time_cost 5
+MIN_MEMORY_COST = 7168  # KiB
+
+ph = PasswordHasher(
+    memory_cost=PASSWORD_HASHER_MEMORY_COST,
+    time_cost=PASSWORD_HASHER_TIME_COST,
+    parallelism=PASSWORD_HASHER_PARALLELISM,
+)
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when all hashing workers are busy and the queue is full"""
 
 
-ph = PasswordHasher(memory_cost=19456, time_cost=2, parallelism=1)
+class HashingPool:
+    """Executor that rejects jobs instead of queueing them without a limit"""
 
+    def __init__(self, pool: str, workers: int, queue_size: int):
+        self.pool = pool
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self.pending = 0
+        self.rejected = 0
+        self._executor: Executor | None = None
 
-def hash_password(password: str) -> str:
-    return ph.hash(password)
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.pool == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="argon2"
+                )
+        return self._executor
 
+    def _release(self) -> None:
+        self.pending -= 1
 
-def verify_hashed_password(password: str, hashed_password: str) -> bool:
+    async def run(self, function: Callable[..., Any], *args: Any) -> Any:
+        # only touched from the event loop thread, no lock needed
+        if self.pending >= self.capacity:
+            self.rejected += 1
+            raise PasswordHasherBusy()
+        loop = asyncio.get_running_loop()
+        future = self._get_executor().submit(function, *args)
+        self.pending += 1
+        # released when the job ends, not when its request is cancelled:
+        # a running job keeps its worker, the callback runs in another thread
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release))
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+hashing_pool = HashingPool(
+    PASSWORD_HASHER_POOL, PASSWORD_HASHER_WORKERS, PASSWORD_HASHER_QUEUE_SIZE
+)
+
+
+# the hasher is passed along, process workers would not see a calibrated one
+def _hash_password(hasher: PasswordHasher, password: str) -> str:
+    return hasher.hash(password)
+
+
+def _verify_hashed_password(
+    hasher: PasswordHasher, password: str, hashed_password: str
+) -> bool:
     try:
-        ph.verify(hashed_password, password)
+        hasher.verify(hashed_password, password)
         return True
     except Argon2Error:
         return False
+
+
+async def hash_password(password: str) -> str:
+    return await hashing_pool.run(_hash_password, ph, password)
+
+
+async def verify_hashed_password(password: str, hashed_password: str) -> bool:
+    return await hashing_pool.run(
+        _verify_hashed_password, ph, password, hashed_password
+    )
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    """Returns whether hash was made with other parameters than the current ones"""
+    try:
+        return ph.check_needs_rehash(hashed_password)
+    except InvalidHashError:
+        return True
+
+
+def configure(hasher: PasswordHasher) -> None:
+    """Hashes new passwords with hasher, existing hashes still verify"""
+    global ph
+    ph = hasher
+
+
+def measure(hasher: PasswordHasher, rounds: int = 3) -> float:
+    """Returns the fastest of rounds hashes in seconds"""
+    fastest = float("inf")
+    for _ in range(rounds):
+        started = perf_counter()
+        hasher.hash("calibration")
+        fastest = min(fastest, perf_counter() - started)
+    return fastest
+
+
+def calibrate(
+    target_latency: float,
+    max_memory_cost: int,
+    parallelism: int = PASSWORD_HASHER_PARALLELISM,
+) -> PasswordHasher:
+    """
+    Returns hasher with the most memory up to max_memory_cost KiB
+    hashing within target_latency seconds, then the most passes within it.
+    Never goes below MIN_MEMORY_COST and one pass, however slow the host is.
+    """
+
+    def hasher(memory_cost: int, time_cost: int) -> PasswordHasher:
+        return PasswordHasher(
+            memory_cost=memory_cost, time_cost=time_cost, parallelism=parallelism
+        )
+
+    memory_cost = max(max_memory_cost, MIN_MEMORY_COST)
+    while (
+        memory_cost > MIN_MEMORY_COST
+        and measure(hasher(memory_cost, 1)) > target_latency
+    ):
+        memory_cost = max(memory_cost // 2, MIN_MEMORY_COST)
+    time_cost = 1
+    while measure(hasher(memory_cost, time_cost + 1)) <= target_latency:
+        time_cost += 1
+    return hasher(memory_cost, time_cost)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m src.crypto")
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="target seconds per hash"
+    )
+    parser.add_argument(
+        "--memory", type=int, default=65536, help="memory budget per hash in KiB"
+    )
+    parser.add_argument("--parallelism", type=int, default=PASSWORD_HASHER_PARALLELISM)
+    args = parser.parse_args()
+
+    calibrated = calibrate(args.latency, args.memory, args.parallelism)
+    print(f"PASSWORD_HASHER_MEMORY_COST: int = {calibrated.memory_cost}  # KiB")
+    print(f"PASSWORD_HASHER_TIME_COST: int = {calibrated.time_cost}")
+    print(f"PASSWORD_HASHER_PARALLELISM: int = {calibrated.parallelism}")
+    print(f"# {measure(calibrated) * 1000:.1f} ms per hash on this machine")
@@ -1,28 +1,71 @@
 from uuid import UUID
 
-from sqlmodel import SQLModel, Field, create_engine
+from sqlalchemy import ForeignKey, Index, event, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlmodel import SQLModel, Field
 
-from .config import DATABASE_URL, DATABASE_ECHO
+from .config import (
+    DATABASE_URL,
+    DATABASE_ECHO,
+    DATABASE_PRAGMAS,
+    DATABASE_POOL_SIZE,
+    DATABASE_MAX_OVERFLOW,
+    DATABASE_READ_POOL_SIZE,
+    DATABASE_READ_MAX_OVERFLOW,
+    DATABASE_POOL_TIMEOUT,
+)
+from .metrics import before_cursor_execute, after_cursor_execute
+from .history import update_days, toggle_days
 
 
 class Users(SQLModel, table=True):
+    # deleted users keep their username until their data is deleted
+    __table_args__ = (
+        Index(
+            "ix_users_username_active",
+            "username",
+            unique=True,
+            sqlite_where=text("deleted_at IS NULL"),
+        ),
+    )
+
     user_id: UUID = Field(primary_key=True, index=True)
     username: str = Field(index=True)
     password: str
     created_at: int
+    # set when user is deleted, until its data is deleted in the background
+    deleted_at: int | None = Field(default=None)
+    # bumped by every write to user's activities, histories and sessions
+    data_version: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
 
 
 class Sessions(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_sessions_user_id_created_at", "user_id", "created_at", "session_id"),
+    )
+
     session_id: str = Field(primary_key=True, index=True)
-    user_id: UUID = Field(foreign_key="users.user_id")
+    user_id: UUID = Field(
+        sa_column_args=[ForeignKey("users.user_id", ondelete="CASCADE")]
+    )
     user_agent: str | None = Field(default=None)
     created_at: int
-    expires_at: int
+    expires_at: int = Field(index=True)
 
 
 class Activities(SQLModel, table=True):
+    # lists are ordered by creation time with the ID as a tie break
+    __table_args__ = (
+        Index(
+            "ix_activities_user_id_created_at", "user_id", "created_at", "activity_id"
+        ),
+    )
+
     activity_id: UUID = Field(primary_key=True)
-    user_id: UUID = Field(foreign_key="users.user_id", index=True)
+    user_id: UUID = Field(
+        sa_column_args=[ForeignKey("users.user_id", ondelete="CASCADE")]
+    )
     title: str
     description: str | None = Field(default=None)
     created_at: int
@@ -30,16 +73,63 @@ class Activities(SQLModel, table=True):
 
 
 class Histories(SQLModel, table=True):
-    history_id: UUID = Field(primary_key=True, index=True)
-    activity_id: UUID = Field(foreign_key="activities.activity_id", index=True)
-    year: int = Field(index=True)
-    month: int = Field(index=True)
-    days: int
+    # one row per activity and year, the primary key is the table
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    activity_id: UUID = Field(
+        sa_column_args=[ForeignKey("activities.activity_id", ondelete="CASCADE")],
+        primary_key=True,
+    )
+    year: int = Field(primary_key=True)
+    # packed year bitmap, see history.pack_year
+    days: bytes
+
+
+def set_pragmas(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    for name, value in DATABASE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+
+def create_functions(dbapi_connection, connection_record) -> None:
+    # histories are updated in place by a single statement
+    dbapi_connection.create_function(
+        "history_update", 3, update_days, deterministic=True
+    )
+    dbapi_connection.create_function(
+        "history_toggle", 2, toggle_days, deterministic=True
+    )
+
 
+def set_read_only(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA query_only = ON")
+    cursor.close()
 
-engine = create_engine(DATABASE_URL, echo=DATABASE_ECHO)
 
+engine = create_async_engine(
+    DATABASE_URL,
+    echo=DATABASE_ECHO,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=DATABASE_POOL_SIZE,
+    max_overflow=DATABASE_MAX_OVERFLOW,
+    pool_timeout=DATABASE_POOL_TIMEOUT,
+)
+event.listen(engine.sync_engine, "connect", set_pragmas)
+event.listen(engine.sync_engine, "connect", create_functions)
+event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+event.listen(engine.sync_engine, "after_cursor_execute", after_cursor_execute)
 
-if __name__ == "__main__":
-    # create tables
-    SQLModel.metadata.create_all(engine)
+read_engine = create_async_engine(
+    DATABASE_URL,
+    echo=DATABASE_ECHO,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=DATABASE_READ_POOL_SIZE,
+    max_overflow=DATABASE_READ_MAX_OVERFLOW,
+    pool_timeout=DATABASE_POOL_TIMEOUT,
+)
+event.listen(read_engine.sync_engine, "connect", set_pragmas)
+event.listen(read_engine.sync_engine, "connect", set_read_only)
+event.listen(read_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+event.listen(read_engine.sync_engine, "after_cursor_execute", after_cursor_execute)
@@ -1,9 +1,36 @@
-from typing import Annotated
+from datetime import date
+from typing import Annotated, AsyncIterator, Literal
 from uuid import UUID
 
-from fastapi import Cookie, Header, Path
+from fastapi import (
+    Cookie,
+    Depends,
+    Header,
+    HTTPException,
+    Path,
+    Query,
+    Request,
+    status,
+)
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
+from .database import engine, read_engine, Users
+from .cache import session_cache
+from .models.activity import ActivityField, ActivityOut
+from .models.session import SessionField, SessionOut
 from .utils import current_year
+from .config import LIST_MAX_LIMIT
+
+
+async def get_session() -> AsyncIterator[AsyncSession]:
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        yield session
+
+
+async def get_read_session() -> AsyncIterator[AsyncSession]:
+    async with AsyncSession(read_engine) as session:
+        yield session
 
 
 class UserAgentHeader:
@@ -16,11 +43,64 @@ class SessionCookie:
         self.session_id = session_id
 
 
+class SessionUser(SessionCookie):
+    """Session cookie with user ID resolved by ValidateSession middleware"""
+
+    def __init__(self, request: Request, session_id: Annotated[str, Cookie()]):
+        super().__init__(session_id)
+        # not set for an empty cookie, the middleware only checks present ones
+        user_id: UUID | None = getattr(request.state, "user_id", None)
+        if user_id is None:
+            raise self.reject()
+        self.user_id = user_id
+
+    def reject(self) -> HTTPException:
+        """
+        Forgets session that another worker deleted while it was cached here,
+        returns error to raise instead of serving it.
+        """
+        session_cache.pop(self.session_id)
+        return HTTPException(status.HTTP_401_UNAUTHORIZED, detail="Invalid session")
+
+
+async def check_data_version(
+    session: Annotated[AsyncSession, Depends(get_read_session)],
+    session_user: Annotated[SessionUser, Depends()],
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> dict[str, str]:
+    """
+    Returns caching headers with ETag of user's data version,
+    raises 304 when If-None-Match has it before the route reads anything else.
+    Only for routes returning nothing but user's data.
+    Reads are not one snapshot, a write between them can make the body newer
+    than the ETag, never older, so clients only refetch once more.
+    """
+    statement = select(Users.data_version).where(Users.user_id == session_user.user_id)
+    data_version = (await session.exec(statement)).first()
+    if data_version is None:
+        raise session_user.reject()
+    etag = f'"{session_user.user_id.hex}.{data_version}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if etag in tags or "*" in tags:
+            raise HTTPException(status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return headers
+
+
 class ActivityPath:
     def __init__(self, activity_id: Annotated[UUID, Path()]):
         self.activity_id = activity_id
 
 
+class ActivitiesQuery:
+    def __init__(
+        self,
+        activity_id: Annotated[list[UUID] | None, Query(max_length=100)] = None,
+    ):
+        self.activity_ids = activity_id
+
+
 class YearPath:
     def __init__(self, year: Annotated[int, Path(ge=2000, le=current_year())]):
         self.year = year
@@ -34,3 +114,116 @@ class MonthPath:
 class DayPath:
     def __init__(self, day: Annotated[int, Path(ge=1, le=31)]):
         self.day = day
+
+
+class DateRangeQuery:
+    def __init__(
+        self,
+        start: Annotated[date | None, Query(ge=date(2000, 1, 1))] = None,
+        end: Annotated[date | None, Query(ge=date(2000, 1, 1))] = None,
+    ):
+        if start and end and start > end:
+            raise HTTPException(
+                status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Start is after end"
+            )
+        self.start = start
+        self.end = end
+
+
+class ActiveQuery:
+    def __init__(self, active: Annotated[bool | None, Query()] = None):
+        self.active = active
+
+
+class CreatedRangeQuery:
+    def __init__(
+        self,
+        created_after: Annotated[int | None, Query(ge=0)] = None,
+        created_before: Annotated[int | None, Query(ge=0)] = None,
+    ):
+        self.created_after = created_after
+        self.created_before = created_before
+
+
+async def check_sessions_version(
+    session: Annotated[AsyncSession, Depends(get_read_session)],
+    session_user: Annotated[SessionUser, Depends()],
+    active_query: Annotated[ActiveQuery, Depends()],
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> dict[str, str]:
+    """
+    check_data_version of session lists. Filtered by active, a list also changes
+    as sessions expire without any write, so it gets no ETag.
+    """
+    if active_query.active is not None:
+        return {"Cache-Control": "private, no-cache"}
+    return await check_data_version(session, session_user, if_none_match)
+
+
+class PageQuery:
+    """
+    Keyset page of a list ordered by creation time and ID.
+    Cursor is the position of the last row of the previous page.
+    """
+
+    def __init__(
+        self,
+        request: Request,
+        limit: Annotated[int | None, Query(ge=1, le=LIST_MAX_LIMIT)] = None,
+        cursor: Annotated[
+            str | None, Query(pattern=r"^[0-9]{1,16}\.[A-Za-z0-9]{1,64}$")
+        ] = None,
+    ):
+        self.request = request
+        self.limit = limit
+        self.after: tuple[int, str] | None = None
+        if cursor is not None:
+            created_at, key = cursor.split(".")
+            self.after = (int(created_at), key)
+
+    def next_link(self, position: tuple[int, UUID | str] | None) -> dict[str, str]:
+        """Returns Link header to the page after position, none on the last page"""
+        if position is None:
+            return {}
+        created_at, key = position
+        cursor = f"{created_at}.{key.hex if isinstance(key, UUID) else key}"
+        url = self.request.url.include_query_params(cursor=cursor)
+        return {"Link": f'<{url.path}?{url.query}>; rel="next"'}
+
+
+class ActivityFieldsQuery:
+    def __init__(
+        self,
+        fields: Annotated[
+            list[ActivityField] | None,
+            Query(
+                max_length=5,
+                description="Fields each activity is limited to, all when not given",
+            ),
+        ] = None,
+    ):
+        # without fields all of them, in the order of ActivityOut
+        self.fields: list[str] = list(
+            dict.fromkeys(fields) if fields else ActivityOut.model_fields
+        )
+
+
+class SessionFieldsQuery:
+    def __init__(
+        self,
+        fields: Annotated[
+            list[SessionField] | None,
+            Query(
+                max_length=4,
+                description="Fields each session is limited to, all when not given",
+            ),
+        ] = None,
+    ):
+        self.fields: list[str] = list(
+            dict.fromkeys(fields) if fields else SessionOut.model_fields
+        )
+
+
+class ExportFormatQuery:
+    def __init__(self, format: Annotated[Literal["ndjson", "csv"], Query()] = "ndjson"):
+        self.format = format
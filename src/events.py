@@ -0,0 +1,188 @@
+"""
+Live changes of user's data, streamed to its devices as server-sent events.
+
+Routes publish events after committing a change, with the data version it
+bumped to as event ID, and every open stream of the user gets them.
+Events are not stored. A stream starts with a ready event carrying the current
+data version, clients refetch what they show when its ETag has another one.
+A stream falling more than EVENTS_QUEUE_SIZE commits behind is closed,
+its client reconnects and refetches.
+
+Streams are kept in memory of the worker process, they only get changes
+made through the same worker.
+"""
+
+import asyncio
+from time import monotonic
+from typing import Any, AsyncIterator, NamedTuple
+from uuid import UUID
+
+import orjson
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from .database import read_engine, Users
+from .models.activity import ActivityOut
+from .models.history import HistoryUpdate
+from .config import (
+    EVENTS_QUEUE_SIZE,
+    EVENTS_HEARTBEAT,
+    EVENTS_MAX_DURATION,
+)
+
+
+class Event(NamedTuple):
+    name: str
+    data: dict[str, Any]
+
+
+def activity_created(activity: ActivityOut) -> Event:
+    return Event("activity_created", activity.model_dump())
+
+
+def activity_updated(activity_id: UUID, values: dict[str, Any]) -> Event:
+    return Event("activity_updated", {"activity_id": activity_id, **values})
+
+
+def activity_deleted(activity_id: UUID) -> Event:
+    return Event("activity_deleted", {"activity_id": activity_id})
+
+
+def history_toggled(activity_id: UUID, year: int, month: int, day: int) -> Event:
+    return Event(
+        "history_toggled",
+        {"activity_id": activity_id, "year": year, "month": month, "day": day},
+    )
+
+
+def history_updated(
+    activity_id: UUID, year: int, month: int, history_update: HistoryUpdate
+) -> Event:
+    return Event(
+        "history_updated",
+        {
+            "activity_id": activity_id,
+            "year": year,
+            "month": month,
+            "set_days": sorted(history_update.set_days),
+            "clear_days": sorted(history_update.clear_days),
+        },
+    )
+
+
+def activities_imported(imported: int) -> Event:
+    return Event("activities_imported", {"imported": imported})
+
+
+def encode(version: int, events: tuple[Event, ...]) -> bytes:
+    """Returns events as server-sent event messages"""
+    return b"".join(
+        b"id: %d\nevent: %s\ndata: %s\n\n"
+        % (version, event.name.encode(), orjson.dumps(event.data))
+        for event in events
+    )
+
+
+class Subscriber:
+    """Bounded queue of one stream, None in it ends the stream"""
+
+    def __init__(self, session_id: str, queue_size: int):
+        self.session_id = session_id
+        self.queue: asyncio.Queue[bytes | None] = asyncio.Queue(queue_size)
+
+    def close(self) -> None:
+        # pending events would not help a client that has to refetch anyway
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class EventBroker:
+    """
+    In-process pub/sub of users' events.
+    Publishing never waits, a stream whose queue is full is closed instead.
+    """
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._subscribers: dict[UUID, set[Subscriber]] = {}
+
+    def streams(self, user_id: UUID) -> int:
+        return len(self._subscribers.get(user_id, ()))
+
+    def subscribe(self, user_id: UUID, session_id: str) -> Subscriber:
+        subscriber = Subscriber(session_id, self.queue_size)
+        self._subscribers.setdefault(user_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, user_id: UUID, subscriber: Subscriber) -> None:
+        subscribers = self._subscribers.get(user_id)
+        if subscribers is None:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self._subscribers[user_id]
+
+    def publish(self, user_id: UUID, version: int, *events: Event) -> None:
+        """Queues events of one commit for every stream of user"""
+        subscribers = self._subscribers.get(user_id)
+        if not subscribers:
+            return
+        # encoded once, queued as one message so a commit takes one place
+        message = encode(version, events)
+        for subscriber in list(subscribers):
+            try:
+                subscriber.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self.dropped += 1
+                subscriber.close()
+                self.unsubscribe(user_id, subscriber)
+
+    def close(self, user_id: UUID, session_id: str | None = None) -> None:
+        """Ends streams of user, or only those opened with session_id"""
+        for subscriber in list(self._subscribers.get(user_id, ())):
+            if session_id is None or subscriber.session_id == session_id:
+                subscriber.close()
+                self.unsubscribe(user_id, subscriber)
+
+
+event_broker = EventBroker(EVENTS_QUEUE_SIZE)
+
+
+async def stream_events(
+    user_id: UUID,
+    session_id: str,
+    heartbeat: float = EVENTS_HEARTBEAT,
+    max_duration: float = EVENTS_MAX_DURATION,
+) -> AsyncIterator[bytes]:
+    """
+    Yields ready event with current data version, then events of user
+    as they are published, with keep-alive comments in between.
+    Ends after max_duration seconds, the client reconnects with a checked session.
+    """
+    # subscribed before reading the version, no change can fall in between
+    subscriber = event_broker.subscribe(user_id, session_id)
+    try:
+        statement = select(Users.data_version).where(Users.user_id == user_id)
+        async with AsyncSession(read_engine) as session:
+            version = (await session.exec(statement)).first()
+        if version is None:
+            # user removed while its session was cached
+            return
+        yield encode(version, (Event("ready", {"version": version}),))
+
+        deadline = monotonic() + max_duration
+        while (remaining := deadline - monotonic()) > 0:
+            try:
+                message = await asyncio.wait_for(
+                    subscriber.queue.get(), min(heartbeat, remaining)
+                )
+            except asyncio.TimeoutError:
+                yield b": keep-alive\n\n"
+                continue
+            if message is None:
+                return
+            yield message
+    finally:
+        event_broker.unsubscribe(user_id, subscriber)
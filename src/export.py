@@ -0,0 +1,123 @@
+import csv
+import io
+from typing import AsyncIterator
+from uuid import UUID
+
+import orjson
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from .database import read_engine, Activities, Histories
+from .history import decode_dates, decode_days, split_months, unpack_year
+from .config import EXPORT_CHUNK_SIZE
+
+
+CSV_HEADER = (
+    "activity_id",
+    "title",
+    "description",
+    "created_at",
+    "ended_at",
+    "year",
+    "month",
+    "days",
+)
+
+
+async def select_export_chunks(
+    user_id: UUID, chunk_size: int = EXPORT_CHUNK_SIZE
+) -> AsyncIterator[list[tuple[Activities, list[tuple[int, int]]]]]:
+    """
+    Yields user's activities with their (year, days) year bitmaps,
+    chunk_size activities at a time ordered by activity ID.
+    Every chunk is read in its own short transaction, the connection
+    is given back to the pool before the chunk is yielded.
+    """
+    last_activity_id: UUID | None = None
+    while True:
+        statement = (
+            select(Activities)
+            .where(Activities.user_id == user_id)
+            .order_by(Activities.activity_id)
+            .limit(chunk_size)
+        )
+        if last_activity_id is not None:
+            statement = statement.where(Activities.activity_id > last_activity_id)
+        async with AsyncSession(read_engine) as session:
+            activities = (await session.exec(statement)).all()
+            if not activities:
+                return
+            statement = (
+                select(Histories.activity_id, Histories.year, Histories.days)
+                .where(
+                    Histories.activity_id.in_(
+                        [activity.activity_id for activity in activities]
+                    )
+                )
+                .order_by(Histories.activity_id, Histories.year)
+            )
+            histories: dict[UUID, list[tuple[int, int]]] = {}
+            for activity_id, year, days in await session.exec(statement):
+                if days:
+                    histories.setdefault(activity_id, []).append(
+                        (year, unpack_year(days))
+                    )
+
+        yield [
+            (activity, histories.get(activity.activity_id, []))
+            for activity in activities
+        ]
+        if len(activities) < chunk_size:
+            return
+        last_activity_id = activities[-1].activity_id
+
+
+async def export_ndjson(user_id: UUID) -> AsyncIterator[bytes]:
+    """Yields one JSON line per activity with the dates it was done"""
+    async for chunk in select_export_chunks(user_id):
+        lines = []
+        for activity, histories in chunk:
+            record = {
+                "activity_id": activity.activity_id,
+                "title": activity.title,
+                "description": activity.description,
+                "created_at": activity.created_at,
+                "ended_at": activity.ended_at,
+                "days": [
+                    day for year, days in histories for day in decode_dates(year, days)
+                ],
+            }
+            lines.append(orjson.dumps(record))
+        yield b"\n".join(lines) + b"\n"
+
+
+async def export_csv(user_id: UUID) -> AsyncIterator[str]:
+    """
+    Yields CSV with one row per activity month with space separated days,
+    activities without history have a single row with empty history columns.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_HEADER)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    async for chunk in select_export_chunks(user_id):
+        for activity, histories in chunk:
+            columns = (
+                activity.activity_id,
+                activity.title,
+                activity.description,
+                activity.created_at,
+                activity.ended_at,
+            )
+            if not histories:
+                writer.writerow(columns + (None, None, None))
+            for year, bitmap in histories:
+                for month, days in split_months(year, bitmap):
+                    writer.writerow(
+                        columns + (year, month, " ".join(map(str, decode_days(days))))
+                    )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
@@ -0,0 +1,169 @@
+"""
+Day bitmaps.
+
+A month bitmap has bit (day - 1) set for every done day of the month.
+Histories are stored per year, bit (day of year - 1) set for every done day,
+packed into little-endian bytes without trailing zero bytes.
+"""
+
+from calendar import monthrange
+from datetime import date, timedelta
+from typing import Iterable
+
+
+def encode_days(days: set[int] | list[int]) -> int:
+    """Returns bitmap with bit (day - 1) set for every day"""
+    bitmap = 0
+    for day in days:
+        bitmap |= 1 << day - 1
+    return bitmap
+
+
+def decode_days(bitmap: int) -> list[int]:
+    """Returns sorted days set in bitmap"""
+    days: list[int] = []
+    while bitmap:
+        lowest = bitmap & -bitmap
+        days.append(lowest.bit_length())
+        bitmap ^= lowest
+    return days
+
+
+def pack_year(bitmap: int) -> bytes:
+    """Returns year bitmap as stored in database"""
+    return bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+
+
+def unpack_year(data: bytes | None) -> int:
+    """Returns year bitmap stored in database"""
+    return int.from_bytes(data or b"", "little")
+
+
+def month_offset(year: int, month: int) -> int:
+    """Returns bit of the first day of month in year bitmap"""
+    return (date(year, month, 1) - date(year, 1, 1)).days
+
+
+def encode_month(year: int, month: int, bitmap: int) -> int:
+    """
+    Returns month bitmap moved to its place in year bitmap,
+    days past the end of month are dropped.
+    """
+    bitmap &= (1 << monthrange(year, month)[1]) - 1
+    return bitmap << month_offset(year, month)
+
+
+def decode_month(year: int, month: int, bitmap: int) -> int:
+    """Returns month bitmap sliced out of year bitmap"""
+    return bitmap >> month_offset(year, month) & (1 << monthrange(year, month)[1]) - 1
+
+
+def split_months(year: int, bitmap: int) -> list[tuple[int, int]]:
+    """Returns (month, days) bitmaps of non-empty months in year bitmap"""
+    months = []
+    for month in range(1, 13):
+        days = decode_month(year, month, bitmap)
+        if days:
+            months.append((month, days))
+    return months
+
+
+def encode_dates(dates: Iterable[date]) -> dict[int, int]:
+    """Returns year bitmaps with dates set, by year"""
+    bitmaps: dict[int, int] = {}
+    for day in dates:
+        offset = (day - date(day.year, 1, 1)).days
+        bitmaps[day.year] = bitmaps.get(day.year, 0) | 1 << offset
+    return bitmaps
+
+
+def decode_dates(year: int, bitmap: int) -> list[date]:
+    """Returns sorted dates set in year bitmap"""
+    first = date(year, 1, 1)
+    return [first + timedelta(days=day - 1) for day in decode_days(bitmap)]
+
+
+def update_days(data: bytes | None, set_data: bytes, clear_data: bytes) -> bytes:
+    """SQL function history_update(days, set, clear) of packed year bitmaps"""
+    return pack_year(
+        (unpack_year(data) | unpack_year(set_data)) & ~unpack_year(clear_data)
+    )
+
+
+def toggle_days(data: bytes | None, toggle_data: bytes) -> bytes:
+    """SQL function history_toggle(days, toggle) of packed year bitmaps"""
+    return pack_year(unpack_year(data) ^ unpack_year(toggle_data))
+
+
+def count_days(bitmaps: Iterable[int], length: int) -> list[int]:
+    """
+    Returns how many bitmaps have bit i set, for every i below length.
+    Bitmaps are added to a bit-sliced counter, bit i of planes[j] is bit j
+    of the count of day i, so each addition works on all days at once.
+    """
+    planes: list[int] = []
+    for bitmap in bitmaps:
+        carry = bitmap
+        for j, plane in enumerate(planes):
+            planes[j], carry = plane ^ carry, plane & carry
+            if not carry:
+                break
+        else:
+            if carry:
+                planes.append(carry)
+
+    counts = [0] * length
+    for j, plane in enumerate(planes):
+        for day in decode_days(plane & (1 << length) - 1):
+            counts[day - 1] += 1 << j
+    return counts
+
+
+def range_bitmap(histories: Iterable[tuple[int, int]], start: date, end: date) -> int:
+    """
+    Joins (year, days) bitmaps into one bitmap
+    with bit i set when day start + i is done, for days up to end.
+    """
+    length = (end - start).days + 1
+    bitmap = 0
+    for year, days in histories:
+        offset = (date(year, 1, 1) - start).days
+        if offset >= 0:
+            bitmap |= days << offset
+        else:
+            bitmap |= days >> -offset
+    return bitmap & (1 << length) - 1
+
+
+def longest_streak(bitmap: int) -> int:
+    """Returns length of the longest run of set bits"""
+    streak = 0
+    while bitmap:
+        bitmap &= bitmap >> 1
+        streak += 1
+    return streak
+
+
+def current_streak(bitmap: int, length: int) -> int:
+    """
+    Returns length of the run of set bits ending at the last bit,
+    or at the one before if the last day is not done yet.
+    """
+    last = length - 1
+    if not bitmap >> last & 1:
+        last -= 1
+    if last < 0:
+        return 0
+    missed = ~bitmap & (1 << last + 1) - 1
+    return last + 1 - missed.bit_length()
+
+
+def weekday_counts(bitmap: int, start: date, length: int) -> list[int]:
+    """Returns number of set bits for every weekday, Monday first"""
+    every_seventh = int("1".zfill(7) * (length // 7 + 1), 2)
+    counts = [0] * 7
+    for shift in range(7):
+        counts[(start.weekday() + shift) % 7] = (
+            bitmap >> shift & every_seventh
+        ).bit_count()
+    return counts
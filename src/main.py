@@ -1,18 +1,123 @@
-from fastapi import FastAPI
+import asyncio
+import logging
+import math
+from contextlib import asynccontextmanager, suppress
 
-from .routers.v1 import auth as v1_auth, user as v1_user, activities as v1_activities
+from fastapi import FastAPI, Request, status
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse
+
+from .routers.v1 import (
+    auth as v1_auth,
+    user as v1_user,
+    activities as v1_activities,
+    batch as v1_batch,
+    events as v1_events,
+)
 from .middlewares import ValidateSession
-from .config import DOCS_URL
+from .metrics import CollectMetrics, render
+from .crypto import calibrate, configure, hashing_pool, PasswordHasherBusy
+from .ratelimit import RateLimited
+from .crud import UserNotFound
+from .cache import session_cache
+from .tasks import sweep_expired_sessions
+from .config import (
+    DOCS_URL,
+    METRICS_URL,
+    METRICS_SERVER_TIMING,
+    PASSWORD_HASHER_RETRY_AFTER,
+    PASSWORD_HASHER_CALIBRATE,
+    PASSWORD_HASHER_TARGET_LATENCY,
+    PASSWORD_HASHER_MAX_MEMORY_COST,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if PASSWORD_HASHER_CALIBRATE:
+        hasher = await asyncio.to_thread(
+            calibrate, PASSWORD_HASHER_TARGET_LATENCY, PASSWORD_HASHER_MAX_MEMORY_COST
+        )
+        configure(hasher)
+        logger.info(
+            "Calibrated password hasher to memory_cost=%d time_cost=%d",
+            hasher.memory_cost,
+            hasher.time_cost,
+        )
+    sweeper = asyncio.create_task(sweep_expired_sessions())
+    yield
+    sweeper.cancel()
+    with suppress(asyncio.CancelledError):
+        await sweeper
+    hashing_pool.shutdown()
 
 
 app = FastAPI(
     title="routina",
     description="Routines tracker",
     docs_url=DOCS_URL,
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
 app.include_router(v1_auth.router)
 app.include_router(v1_user.router)
 app.include_router(v1_activities.router)
+app.include_router(v1_batch.router)
+app.include_router(v1_events.router)
+
+app.add_middleware(
+    ValidateSession,
+    public_paths={
+        path
+        for path in (
+            "/v1/auth/register",
+            "/v1/auth/login",
+            app.docs_url,
+            app.swagger_ui_oauth2_redirect_url,
+            app.redoc_url,
+            app.openapi_url,
+            METRICS_URL,
+        )
+        if path
+    },
+)
+# added last so it also measures session validation
+app.add_middleware(CollectMetrics, server_timing=METRICS_SERVER_TIMING)
+
+if METRICS_URL:
+
+    @app.get(METRICS_URL, include_in_schema=False)
+    async def get_metrics() -> PlainTextResponse:
+        """Returns request and SQL metrics of this worker"""
+        return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
+
+
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Server is busy, try again later"},
+        headers={"Retry-After": str(PASSWORD_HASHER_RETRY_AFTER)},
+    )
+
+
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request: Request, exc: RateLimited):
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"detail": "Too many attempts, try again later"},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
+
 
-app.add_middleware(ValidateSession)
+@app.exception_handler(UserNotFound)
+async def user_not_found_handler(request: Request, exc: UserNotFound):
+    # user deleted through another worker, same as SessionUser.reject
+    session_cache.pop(request.cookies.get("session_id"))
+    return JSONResponse(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        content={"detail": "Invalid session"},
+    )
@@ -0,0 +1,201 @@
+from contextvars import ContextVar
+from time import perf_counter
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .crypto import hashing_pool
+from .ratelimit import address_limiter, username_limiter
+
+
+# upper bounds of request latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestMetrics:
+    """SQL queries made while serving a single request"""
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+
+
+class RouteMetrics:
+    """Totals of all requests served by a route"""
+
+    def __init__(self):
+        self.count = 0
+        self.statuses: dict[int, int] = {}
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.latency = 0.0
+        self.queries = 0
+        self.sql_time = 0.0
+
+    def observe(self, status: int, latency: float, request: RequestMetrics) -> None:
+        self.count += 1
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                self.buckets[i] += 1
+                break
+        self.latency += latency
+        self.queries += request.queries
+        self.sql_time += request.sql_time
+
+
+request_metrics: ContextVar[RequestMetrics | None] = ContextVar(
+    "request_metrics", default=None
+)
+# keyed by method and route path, paths are templates so there are few keys
+routes: dict[tuple[str, str], RouteMetrics] = {}
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.query_started = perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    metrics = request_metrics.get()
+    if metrics is not None:
+        metrics.queries += 1
+        metrics.sql_time += perf_counter() - context.query_started
+
+
+def route_path(scope: Scope) -> str:
+    route = scope.get("route")
+    # requests rejected before routing are counted together
+    return getattr(route, "path", "unmatched")
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render() -> str:
+    """Returns metrics of all routes in Prometheus text format"""
+    lines = [
+        "# HELP routina_requests_total Requests served.",
+        "# TYPE routina_requests_total counter",
+    ]
+    for (method, path), metrics in sorted(routes.items()):
+        labels = f'method="{method}",route="{escape(path)}"'
+        for status, count in sorted(metrics.statuses.items()):
+            lines.append(
+                f'routina_requests_total{{{labels},status="{status}"}} {count}'
+            )
+
+    lines += [
+        "# HELP routina_request_duration_seconds Request latency.",
+        "# TYPE routina_request_duration_seconds histogram",
+    ]
+    for (method, path), metrics in sorted(routes.items()):
+        labels = f'method="{method}",route="{escape(path)}"'
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, metrics.buckets):
+            cumulative += count
+            lines.append(
+                f'routina_request_duration_seconds_bucket{{{labels},le="{bound}"}}'
+                f" {cumulative}"
+            )
+        lines += [
+            f'routina_request_duration_seconds_bucket{{{labels},le="+Inf"}}'
+            f" {metrics.count}",
+            f"routina_request_duration_seconds_sum{{{labels}}} {metrics.latency}",
+            f"routina_request_duration_seconds_count{{{labels}}} {metrics.count}",
+        ]
+
+    lines += [
+        "# HELP routina_sql_queries_total SQL queries made while serving requests.",
+        "# TYPE routina_sql_queries_total counter",
+    ]
+    for (method, path), metrics in sorted(routes.items()):
+        labels = f'method="{method}",route="{escape(path)}"'
+        lines.append(f"routina_sql_queries_total{{{labels}}} {metrics.queries}")
+
+    lines += [
+        "# HELP routina_sql_duration_seconds_total Time spent in SQL queries.",
+        "# TYPE routina_sql_duration_seconds_total counter",
+    ]
+    for (method, path), metrics in sorted(routes.items()):
+        labels = f'method="{method}",route="{escape(path)}"'
+        lines.append(
+            f"routina_sql_duration_seconds_total{{{labels}}} {metrics.sql_time}"
+        )
+
+    lines += [
+        "# HELP routina_rate_limit_total Login and register attempts.",
+        "# TYPE routina_rate_limit_total counter",
+    ]
+    for limiter in (address_limiter, username_limiter):
+        for result, count in (
+            ("allowed", limiter.allowed),
+            ("rejected", limiter.rejected),
+        ):
+            lines.append(
+                f'routina_rate_limit_total{{limiter="{limiter.name}",'
+                f'result="{result}"}} {count}'
+            )
+
+    lines += [
+        "# HELP routina_rate_limit_keys Clients tracked by rate limiter.",
+        "# TYPE routina_rate_limit_keys gauge",
+    ]
+    for limiter in (address_limiter, username_limiter):
+        lines.append(
+            f'routina_rate_limit_keys{{limiter="{limiter.name}"}} {len(limiter)}'
+        )
+
+    lines += [
+        "# HELP routina_password_hasher_pending Hashing jobs running or queued.",
+        "# TYPE routina_password_hasher_pending gauge",
+        f"routina_password_hasher_pending {hashing_pool.pending}",
+        "# HELP routina_password_hasher_rejected_total Hashing jobs rejected as busy.",
+        "# TYPE routina_password_hasher_rejected_total counter",
+        f"routina_password_hasher_rejected_total {hashing_pool.rejected}",
+    ]
+
+    return "\n".join(lines) + "\n"
+
+
+class CollectMetrics:
+    """
+    Records latency, status and SQL queries of every request per route.
+    Optionally reports them to the client in Server-Timing header.
+    """
+
+    def __init__(self, app: ASGIApp, server_timing: bool = False):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        metrics = RequestMetrics()
+        token = request_metrics.set(metrics)
+        started = perf_counter()
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    elapsed = (perf_counter() - started) * 1000
+                    MutableHeaders(scope=message).append(
+                        "Server-Timing",
+                        f'db;desc="{metrics.queries} queries"'
+                        f";dur={metrics.sql_time * 1000:.2f}, app;dur={elapsed:.2f}",
+                    )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_metrics.reset(token)
+            key = (scope["method"], route_path(scope))
+            route = routes.get(key)
+            if route is None:
+                route = routes[key] = RouteMetrics()
+            route.observe(status, perf_counter() - started, metrics)
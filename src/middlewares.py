@@ -1,37 +1,69 @@
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
+from collections.abc import Collection
+
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Receive, Scope, Send
 from pydantic import ValidationError
-from fastapi import HTTPException, status
+from fastapi import status
 from fastapi.responses import JSONResponse
-from sqlmodel import Session as SQLSession, select
+from sqlmodel import delete, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from .database import engine, Sessions
+from .database import engine, read_engine, Sessions
 from .models.session import Session
+from .cache import session_cache
+from .crud import bump_data_version
 from .utils import unix_time
 
 
-class ValidateSession(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        session_id = request.cookies.get("session_id")
+class ValidateSession:
+    """
+    Rejects requests with invalid or expired session cookie.
+    Puts user ID of a valid session in request state.
+    """
+
+    def __init__(self, app: ASGIApp, public_paths: Collection[str] = ()):
+        self.app = app
+        self.public_paths = frozenset(public_paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] in self.public_paths:
+            await self.app(scope, receive, send)
+            return
+
+        session_id = HTTPConnection(scope).cookies.get("session_id")
         if session_id:
-            try:
-                Session(session_id=session_id)
-            except ValidationError:
-                return JSONResponse(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    content={"message": "Invalid session"},
-                )
-            statement = select(Sessions).where(Sessions.session_id == session_id)
-            with SQLSession(engine) as session:
-                session_entry: Sessions = session.exec(statement).first()
+            user_id = session_cache.get(session_id)
+            if user_id is None:
+                try:
+                    Session(session_id=session_id)
+                except ValidationError:
+                    response = JSONResponse(
+                        status_code=status.HTTP_401_UNAUTHORIZED,
+                        content={"message": "Invalid session"},
+                    )
+                    await response(scope, receive, send)
+                    return
+                statement = select(Sessions).where(Sessions.session_id == session_id)
+                async with AsyncSession(read_engine) as session:
+                    session_entry: Sessions = (await session.exec(statement)).first()
                 if not session_entry:
-                    return JSONResponse(
+                    response = JSONResponse(
                         status_code=status.HTTP_401_UNAUTHORIZED,
                         content={"message": "Invalid session"},
                     )
+                    await response(scope, receive, send)
+                    return
                 if unix_time() > session_entry.expires_at:
-                    session.delete(session_entry)
-                    session.commit()
+                    statement = delete(Sessions).where(
+                        Sessions.session_id == session_id
+                    )
+                    async with AsyncSession(engine) as session:
+                        result = await session.exec(statement)
+                        # cached session lists still have it, unless another
+                        # request deleted it first and bumped the version
+                        if result.rowcount == 1:
+                            await bump_data_version(session, session_entry.user_id)
+                        await session.commit()
                     response = JSONResponse(
                         status_code=status.HTTP_401_UNAUTHORIZED,
                         content={"message": "Session expired"},
@@ -42,7 +74,10 @@ class ValidateSession(BaseHTTPMiddleware):
                         httponly=True,
                         secure=True,
                     )
-                    return response
+                    await response(scope, receive, send)
+                    return
+                user_id = session_entry.user_id
+                session_cache.set(session_id, user_id, session_entry.expires_at)
+            scope.setdefault("state", {})["user_id"] = user_id
 
-        response = await call_next(request)
-        return response
+        await self.app(scope, receive, send)
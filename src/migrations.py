@@ -0,0 +1,291 @@
+"""
+Versioned schema migrations.
+
+Version of the schema is kept in SQLite user_version pragma.
+A new database gets the current schema and the latest version,
+an existing one runs every migration after its version, each in its own transaction.
+
+Upgrade database in place: python -m src.migrations
+"""
+
+import asyncio
+from typing import Callable
+
+from sqlalchemy import Connection, inspect
+from sqlmodel import SQLModel
+
+from .database import engine
+from .history import encode_month, pack_year
+from .utils import unix_time
+
+
+def _add_history_and_session_indexes(connection: Connection) -> None:
+    # merge duplicated histories, unique index can not be created otherwise
+    duplicates = connection.exec_driver_sql(
+        "SELECT activity_id, year, month FROM histories"
+        " GROUP BY activity_id, year, month HAVING count(*) > 1"
+    ).all()
+    for activity_id, year, month in duplicates:
+        rows = connection.exec_driver_sql(
+            "SELECT history_id, days FROM histories"
+            " WHERE activity_id = ? AND year = ? AND month = ?",
+            (activity_id, year, month),
+        ).all()
+        days = 0
+        for _, row_days in rows:
+            days |= row_days
+        connection.exec_driver_sql(
+            "UPDATE histories SET days = ? WHERE history_id = ?", (days, rows[0][0])
+        )
+        for history_id, _ in rows[1:]:
+            connection.exec_driver_sql(
+                "DELETE FROM histories WHERE history_id = ?", (history_id,)
+            )
+
+    connection.exec_driver_sql("DROP INDEX IF EXISTS ix_histories_activity_id")
+    connection.exec_driver_sql("DROP INDEX IF EXISTS ix_histories_year")
+    connection.exec_driver_sql("DROP INDEX IF EXISTS ix_histories_month")
+    connection.exec_driver_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_histories_activity_id_year_month"
+        " ON histories (activity_id, year, month)"
+    )
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_sessions_user_id ON sessions (user_id)"
+    )
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_sessions_expires_at ON sessions (expires_at)"
+    )
+
+
+def _rebuild_table(connection: Connection, table: str, schema: str) -> None:
+    # sqlite can not alter constraints, the table is copied into a new one
+    # runs with foreign keys off, see upgrade
+    columns = ", ".join(
+        row[1]
+        for row in connection.exec_driver_sql(f"PRAGMA table_info({table})").all()
+    )
+    connection.exec_driver_sql(f"CREATE TABLE new_{table} ({schema})")
+    connection.exec_driver_sql(
+        f"INSERT INTO new_{table} ({columns}) SELECT {columns} FROM {table}"
+    )
+    connection.exec_driver_sql(f"DROP TABLE {table}")
+    connection.exec_driver_sql(f"ALTER TABLE new_{table} RENAME TO {table}")
+
+
+def _cascade_user_deletion(connection: Connection) -> None:
+    connection.exec_driver_sql("ALTER TABLE users ADD COLUMN deleted_at INTEGER")
+    _rebuild_table(
+        connection,
+        "sessions",
+        "session_id VARCHAR NOT NULL, user_id CHAR(32) NOT NULL,"
+        " user_agent VARCHAR, created_at INTEGER NOT NULL,"
+        " expires_at INTEGER NOT NULL, PRIMARY KEY (session_id),"
+        " FOREIGN KEY(user_id) REFERENCES users (user_id) ON DELETE CASCADE",
+    )
+    _rebuild_table(
+        connection,
+        "activities",
+        "activity_id CHAR(32) NOT NULL, user_id CHAR(32) NOT NULL,"
+        " title VARCHAR NOT NULL, description VARCHAR,"
+        " created_at INTEGER NOT NULL, ended_at INTEGER,"
+        " PRIMARY KEY (activity_id),"
+        " FOREIGN KEY(user_id) REFERENCES users (user_id) ON DELETE CASCADE",
+    )
+    _rebuild_table(
+        connection,
+        "histories",
+        "history_id CHAR(32) NOT NULL, activity_id CHAR(32) NOT NULL,"
+        " year INTEGER NOT NULL, month INTEGER NOT NULL, days INTEGER NOT NULL,"
+        " PRIMARY KEY (history_id),"
+        " FOREIGN KEY(activity_id) REFERENCES activities (activity_id)"
+        " ON DELETE CASCADE",
+    )
+    # indexes are dropped with the old tables
+    for index in (
+        "ix_sessions_session_id ON sessions (session_id)",
+        "ix_sessions_user_id ON sessions (user_id)",
+        "ix_sessions_expires_at ON sessions (expires_at)",
+        "ix_activities_user_id ON activities (user_id)",
+        "ix_histories_history_id ON histories (history_id)",
+    ):
+        connection.exec_driver_sql(f"CREATE INDEX {index}")
+    connection.exec_driver_sql(
+        "CREATE UNIQUE INDEX ix_histories_activity_id_year_month"
+        " ON histories (activity_id, year, month)"
+    )
+
+
+# activities copied per transaction while packing histories
+PACK_CHUNK_SIZE = 1000
+
+
+def _pack_year(connection: Connection, activity_id: str, year: int) -> None:
+    # copies months of one activity year from histories into yearly_histories
+    bitmap = 0
+    for month, days in connection.exec_driver_sql(
+        "SELECT month, days FROM histories WHERE activity_id = ? AND year = ?",
+        (activity_id, year),
+    ):
+        bitmap |= encode_month(year, month, days)
+    if bitmap:
+        connection.exec_driver_sql(
+            "INSERT OR REPLACE INTO yearly_histories VALUES (?, ?, ?)",
+            (activity_id, year, pack_year(bitmap)),
+        )
+    else:
+        connection.exec_driver_sql(
+            "DELETE FROM yearly_histories WHERE activity_id = ? AND year = ?",
+            (activity_id, year),
+        )
+
+
+def _pack_yearly_histories(connection: Connection) -> None:
+    """
+    Replaces monthly histories with one packed bitmap per activity and year.
+    Histories are copied in short transactions, so the previous version
+    can keep serving meanwhile. Triggers note years it changes,
+    those are copied again in the final transaction swapping the tables.
+    Interrupted copying continues after the last copied activity.
+    """
+    connection.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS yearly_histories"
+        " (activity_id CHAR(32) NOT NULL, year INTEGER NOT NULL, days BLOB NOT NULL,"
+        " PRIMARY KEY (activity_id, year),"
+        " FOREIGN KEY(activity_id) REFERENCES activities (activity_id)"
+        " ON DELETE CASCADE) WITHOUT ROWID"
+    )
+    connection.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS changed_histories"
+        " (activity_id CHAR(32) NOT NULL, year INTEGER NOT NULL,"
+        " PRIMARY KEY (activity_id, year)) WITHOUT ROWID"
+    )
+    for operation, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+        connection.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS histories_{operation.lower()}_changed"
+            f" AFTER {operation} ON histories BEGIN"
+            " INSERT OR IGNORE INTO changed_histories"
+            f" VALUES ({row}.activity_id, {row}.year); END"
+        )
+    connection.commit()
+
+    last_activity_id = connection.exec_driver_sql(
+        "SELECT coalesce(max(activity_id), '') FROM yearly_histories"
+    ).scalar_one()
+    while True:
+        # take the write lock first, a deferred transaction could not upgrade to it
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+        years = connection.exec_driver_sql(
+            "SELECT DISTINCT activity_id, year FROM histories WHERE activity_id IN"
+            " (SELECT DISTINCT activity_id FROM histories WHERE activity_id > ?"
+            " ORDER BY activity_id LIMIT ?)",
+            (last_activity_id, PACK_CHUNK_SIZE),
+        ).all()
+        if not years:
+            break
+        for activity_id, year in years:
+            _pack_year(connection, activity_id, year)
+        connection.commit()
+        last_activity_id = max(activity_id for activity_id, _ in years)
+
+    for activity_id, year in connection.exec_driver_sql(
+        "SELECT activity_id, year FROM changed_histories"
+    ).all():
+        _pack_year(connection, activity_id, year)
+    for operation in ("insert", "update", "delete"):
+        connection.exec_driver_sql(f"DROP TRIGGER histories_{operation}_changed")
+    connection.exec_driver_sql("DROP TABLE changed_histories")
+    connection.exec_driver_sql("DROP TABLE histories")
+    connection.exec_driver_sql("ALTER TABLE yearly_histories RENAME TO histories")
+
+
+def _add_data_version(connection: Connection) -> None:
+    connection.exec_driver_sql(
+        "ALTER TABLE users ADD COLUMN data_version INTEGER DEFAULT '0' NOT NULL"
+    )
+
+
+def _add_list_indexes(connection: Connection) -> None:
+    # user_id prefix of the new indexes serves lookups and cascades by user
+    connection.exec_driver_sql("DROP INDEX IF EXISTS ix_activities_user_id")
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_activities_user_id_created_at"
+        " ON activities (user_id, created_at, activity_id)"
+    )
+    connection.exec_driver_sql("DROP INDEX IF EXISTS ix_sessions_user_id")
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_sessions_user_id_created_at"
+        " ON sessions (user_id, created_at, session_id)"
+    )
+
+
+def _add_unique_username_index(connection: Connection) -> None:
+    # concurrent registrations could create the same username more than once,
+    # the first user keeps it, the others are deleted like users deleting themselves
+    duplicates = connection.exec_driver_sql(
+        "SELECT user_id FROM users AS duplicate WHERE deleted_at IS NULL"
+        " AND EXISTS (SELECT 1 FROM users WHERE deleted_at IS NULL"
+        " AND username = duplicate.username"
+        " AND (created_at, rowid) < (duplicate.created_at, duplicate.rowid))"
+    ).all()
+    for (user_id,) in duplicates:
+        connection.exec_driver_sql("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+        connection.exec_driver_sql(
+            "UPDATE users SET deleted_at = ? WHERE user_id = ?",
+            (unix_time(), user_id),
+        )
+    connection.exec_driver_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_username_active"
+        " ON users (username) WHERE deleted_at IS NULL"
+    )
+
+
+# append only, position in the list is the version a migration upgrades to
+MIGRATIONS: list[Callable[[Connection], None]] = [
+    _add_history_and_session_indexes,
+    _cascade_user_deletion,
+    _pack_yearly_histories,
+    _add_data_version,
+    _add_list_indexes,
+    _add_unique_username_index,
+]
+
+
+def get_version(connection: Connection) -> int:
+    return connection.exec_driver_sql("PRAGMA user_version").scalar_one()
+
+
+def set_version(connection: Connection, version: int) -> None:
+    # pragma does not accept bound parameters
+    connection.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+
+
+def upgrade(connection: Connection) -> None:
+    version = get_version(connection)
+    if version == 0 and not inspect(connection).has_table("users"):
+        connection.exec_driver_sql("BEGIN")
+        SQLModel.metadata.create_all(connection)
+        set_version(connection, len(MIGRATIONS))
+        connection.commit()
+        return
+
+    # dropping a table while rebuilding it would cascade with foreign keys on,
+    # the pragma has no effect inside a transaction
+    connection.exec_driver_sql("PRAGMA foreign_keys = OFF")
+    try:
+        for version, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            connection.exec_driver_sql("BEGIN")
+            migration(connection)
+            set_version(connection, version)
+            connection.commit()
+    finally:
+        connection.rollback()
+        connection.exec_driver_sql("PRAGMA foreign_keys = ON")
+
+
+async def migrate() -> None:
+    async with engine.connect() as connection:
+        await connection.run_sync(upgrade)
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
@@ -1,7 +1,10 @@
-from typing import Annotated
+from datetime import date
+from typing import Annotated, Literal
 from uuid import UUID
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
+
+from ..utils import current_year
 
 
 class Activity(BaseModel):
@@ -24,12 +27,53 @@ class ActivityIn(Activity):
     pass
 
 
+class ActivityImport(ActivityIn):
+    created_at: int | None = None
+    ended_at: int | None = None
+    # up to a hundred years of days
+    days: Annotated[
+        set[Annotated[date, Field(ge=date(2000, 1, 1))]], Field(max_length=36600)
+    ] = set()
+
+    @field_validator("days")
+    @classmethod
+    def check_year(cls, days: set[date]) -> set[date]:
+        if any(day.year > current_year() for day in days):
+            raise ValueError("Day can not be after this year")
+        return days
+
+
+class ActivityImportError(BaseModel):
+    line: int
+    errors: list[str]
+
+
+class ActivityImportOut(BaseModel):
+    imported: int
+    failed: int
+    # only the first errors are reported
+    errors: list[ActivityImportError]
+
+
 class ActivityOut(Activity):
     activity_id: UUID
     created_at: int
     ended_at: int | None = None
 
 
+# fields of ActivityOut a list can be limited to
+ActivityField = Literal["activity_id", "title", "description", "created_at", "ended_at"]
+
+
+# ActivityOut in a list limited by fields, only those asked for are present
+class ActivityFieldsOut(BaseModel):
+    activity_id: UUID | None = None
+    title: str | None = None
+    description: str | None = None
+    created_at: int | None = None
+    ended_at: int | None = None
+
+
 class ActivityUpdate(BaseModel):
     title: Annotated[
         str | None,
@@ -0,0 +1,80 @@
+from typing import Annotated, Literal
+from uuid import UUID
+
+from pydantic import BaseModel, Field, field_validator
+
+from .activity import ActivityIn, ActivityOut, ActivityUpdate
+from .history import Day, HistoryUpdate
+from ..config import BATCH_MAX_OPERATIONS
+from ..utils import current_year
+
+
+# activity ID, or index of an earlier create_activity operation in the batch
+ActivityRef = UUID | Annotated[int, Field(ge=0)]
+
+
+class CreateActivity(BaseModel):
+    op: Literal["create_activity"]
+    activity: ActivityIn
+
+
+class UpdateActivity(BaseModel):
+    op: Literal["update_activity"]
+    activity_id: ActivityRef
+    update: ActivityUpdate
+
+
+class DeleteActivity(BaseModel):
+    op: Literal["delete_activity"]
+    activity_id: ActivityRef
+
+
+class HistoryOperation(BaseModel):
+    activity_id: ActivityRef
+    year: Annotated[int, Field(ge=2000)]
+    month: Annotated[int, Field(ge=1, le=12)]
+
+    @field_validator("year")
+    @classmethod
+    def check_year(cls, year: int) -> int:
+        if year > current_year():
+            raise ValueError("Year can not be after this year")
+        return year
+
+
+class ToggleHistoryDay(HistoryOperation):
+    op: Literal["toggle_history_day"]
+    day: Day
+
+
+class UpdateHistoryDays(HistoryOperation):
+    op: Literal["update_history_days"]
+    update: HistoryUpdate
+
+
+Operation = Annotated[
+    CreateActivity
+    | UpdateActivity
+    | DeleteActivity
+    | ToggleHistoryDay
+    | UpdateHistoryDays,
+    Field(discriminator="op"),
+]
+
+
+class BatchIn(BaseModel):
+    operations: Annotated[
+        list[Operation], Field(min_length=1, max_length=BATCH_MAX_OPERATIONS)
+    ]
+
+
+class OperationOut(BaseModel):
+    status: int
+    detail: str | None = None
+    # created by create_activity
+    activity: ActivityOut | None = None
+
+
+class BatchOut(BaseModel):
+    # in order of operations
+    results: list[OperationOut]
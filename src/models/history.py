@@ -0,0 +1,25 @@
+from typing import Annotated
+from uuid import UUID
+
+from pydantic import BaseModel, Field, model_validator
+
+
+Day = Annotated[int, Field(ge=1, le=31)]
+
+
+class HistoryUpdate(BaseModel):
+    set_days: Annotated[set[Day], Field(max_length=31)] = set()
+    clear_days: Annotated[set[Day], Field(max_length=31)] = set()
+
+    @model_validator(mode="after")
+    def check_disjoint(self) -> "HistoryUpdate":
+        if self.set_days & self.clear_days:
+            raise ValueError("Day can not be both set and cleared")
+        return self
+
+
+class HistoryOut(BaseModel):
+    activity_id: UUID
+    year: int
+    month: int
+    days: list[int]
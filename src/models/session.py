@@ -1,4 +1,4 @@
-from typing import Annotated
+from typing import Annotated, Literal
 
 from pydantic import BaseModel, Field
 
@@ -14,3 +14,15 @@ class SessionOut(Session):
     user_agent: str | None = None
     created_at: int
     expires_at: int
+
+
+# fields of SessionOut a list can be limited to
+SessionField = Literal["session_id", "user_agent", "created_at", "expires_at"]
+
+
+# SessionOut in a list limited by fields, only those asked for are present
+class SessionFieldsOut(BaseModel):
+    session_id: str | None = None
+    user_agent: str | None = None
+    created_at: int | None = None
+    expires_at: int | None = None
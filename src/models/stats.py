@@ -0,0 +1,29 @@
+from datetime import date
+from uuid import UUID
+
+from pydantic import BaseModel
+
+
+class Stats(BaseModel):
+    start: date
+    end: date
+    completed: int
+    completion_rate: float
+    # Monday first
+    weekdays: list[int]
+
+
+class ActivityStatsOut(Stats):
+    activity_id: UUID
+    current_streak: int
+    longest_streak: int
+
+
+class UserStatsOut(Stats):
+    activities: list[ActivityStatsOut]
+
+
+class HeatmapOut(BaseModel):
+    year: int
+    # number of activities done on every day of the year, January 1 first
+    days: list[int]
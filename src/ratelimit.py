@@ -0,0 +1,78 @@
+from collections import OrderedDict
+from time import monotonic
+from typing import Hashable
+
+from .config import (
+    AUTH_RATE_LIMIT_ADDRESS_RATE,
+    AUTH_RATE_LIMIT_ADDRESS_BURST,
+    AUTH_RATE_LIMIT_USERNAME_RATE,
+    AUTH_RATE_LIMIT_USERNAME_BURST,
+    AUTH_RATE_LIMIT_MAX_KEYS,
+)
+
+
+class RateLimited(Exception):
+    """Raised when a client made too many attempts"""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """
+    Token bucket per key, every attempt takes a token and tokens refill
+    at rate per second up to burst. Keeps at most max_keys buckets,
+    the least recently used one is evicted.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, max_keys: int):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.allowed = 0
+        self.rejected = 0
+        self._buckets: OrderedDict[Hashable, tuple[float, float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def acquire(self, key: Hashable) -> float:
+        """Takes a token, returns 0 or seconds until the next one if there is none"""
+        now = monotonic()
+        tokens, updated_at = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        if tokens < 1:
+            self.rejected += 1
+            retry_after = (1 - tokens) / self.rate
+        else:
+            self.allowed += 1
+            tokens -= 1
+            retry_after = 0
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+    def check(self, key: Hashable) -> None:
+        """Takes a token, raises RateLimited if there is none"""
+        retry_after = self.acquire(key)
+        if retry_after:
+            raise RateLimited(retry_after)
+
+
+# login and register attempts of a client address
+address_limiter = RateLimiter(
+    "address",
+    AUTH_RATE_LIMIT_ADDRESS_RATE,
+    AUTH_RATE_LIMIT_ADDRESS_BURST,
+    AUTH_RATE_LIMIT_MAX_KEYS,
+)
+# login attempts to an account from any address
+username_limiter = RateLimiter(
+    "username",
+    AUTH_RATE_LIMIT_USERNAME_RATE,
+    AUTH_RATE_LIMIT_USERNAME_BURST,
+    AUTH_RATE_LIMIT_MAX_KEYS,
+)
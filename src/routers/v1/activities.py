@@ -1,125 +1,394 @@
+from collections import defaultdict
+from datetime import date
 from typing import Annotated
+from uuid import UUID
 
 from fastapi import APIRouter, Depends, status
+from fastapi.responses import ORJSONResponse
 from fastapi.exceptions import HTTPException
-from sqlmodel import Session, select
-
-from ...models.activity import ActivityIn, ActivityOut, ActivityUpdate
-from ...dependencies import SessionCookie, ActivityPath, YearPath, MonthPath, DayPath
-from ...database import Sessions, Activities, Histories, engine
-from ...utils import create_uuid_v4, unix_time
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ...models.activity import (
+    ActivityIn,
+    ActivityOut,
+    ActivityFieldsOut,
+    ActivityUpdate,
+)
+from ...models.history import HistoryUpdate, HistoryOut
+from ...models.stats import ActivityStatsOut, UserStatsOut, HeatmapOut
+from ...dependencies import (
+    get_session,
+    get_read_session,
+    check_data_version,
+    SessionUser,
+    ActiveQuery,
+    CreatedRangeQuery,
+    PageQuery,
+    ActivityFieldsQuery,
+    ActivitiesQuery,
+    DateRangeQuery,
+    ActivityPath,
+    YearPath,
+    MonthPath,
+    DayPath,
+)
+from ...database import Activities, Histories, Users
+from ... import crud, events
+from ...history import (
+    range_bitmap,
+    unpack_year,
+    current_streak,
+    longest_streak,
+    weekday_counts,
+)
+from ...cache import stats_cache
+from ...events import event_broker
 
 
 router = APIRouter(prefix="/v1/activities", tags=["activities"])
 
 
-@router.get("", status_code=status.HTTP_200_OK, response_model=list[ActivityOut])
-async def get_activities(
-    session_cookie: Annotated[SessionCookie, Depends()]
-) -> list[ActivityOut]:
-    """Returns all activities"""
-    with Session(engine) as session:
-        statement = select(Sessions.user_id).where(
-            Sessions.session_id == session_cookie.session_id
+def build_activity_stats(
+    activity_id: UUID,
+    histories: list[tuple[int, int]],
+    start: date,
+    end: date,
+) -> ActivityStatsOut:
+    length = (end - start).days + 1
+    bitmap = range_bitmap(histories, start, end)
+    completed = bitmap.bit_count()
+    return ActivityStatsOut(
+        activity_id=activity_id,
+        start=start,
+        end=end,
+        completed=completed,
+        completion_rate=completed / length,
+        weekdays=weekday_counts(bitmap, start, length),
+        current_streak=current_streak(bitmap, length),
+        longest_streak=longest_streak(bitmap),
+    )
+
+
+async def select_activities_stats(
+    session: AsyncSession,
+    user_id: UUID,
+    date_range: DateRangeQuery,
+    activity_ids: list[UUID] | None = None,
+) -> list[ActivityStatsOut]:
+    """
+    Returns statistics of user's activities.
+    Statistics since activity creation until today are served from cache
+    while user's data version is the one they were computed at.
+    """
+    cacheable = date_range.start is None and date_range.end is None
+    if cacheable:
+        # read before histories, stats cached under it can only be newer than it
+        statement = select(Users.data_version).where(Users.user_id == user_id)
+        data_version = (await session.exec(statement)).first()
+    statement = (
+        select(Activities.activity_id, Activities.created_at)
+        .where(Activities.user_id == user_id)
+        .order_by(Activities.created_at)
+    )
+    if activity_ids is not None:
+        statement = statement.where(Activities.activity_id.in_(activity_ids))
+    activities = (await session.exec(statement)).all()
+
+    today = date.today()
+    stats: dict[UUID, ActivityStatsOut] = {}
+    ranges: dict[UUID, tuple[date, date]] = {}
+    for activity_id, created_at in activities:
+        if cacheable:
+            # written through another worker when the version differs
+            cached: tuple[int, ActivityStatsOut] | None = stats_cache.get(activity_id)
+            if cached and cached[0] == data_version and cached[1].end == today:
+                stats[activity_id] = cached[1]
+                continue
+        end = date_range.end or today
+        start = min(date_range.start or date.fromtimestamp(created_at), end)
+        ranges[activity_id] = (start, end)
+
+    if ranges:
+        first = min(start for start, _ in ranges.values())
+        last = max(end for _, end in ranges.values())
+        statement = select(Histories.activity_id, Histories.year, Histories.days).where(
+            Histories.activity_id.in_(ranges),
+            Histories.year >= first.year,
+            Histories.year <= last.year,
         )
-        user_id = session.exec(statement).first()
+        histories: dict[UUID, list[tuple[int, int]]] = defaultdict(list)
+        for activity_id, year, days in await session.exec(statement):
+            histories[activity_id].append((year, unpack_year(days)))
+
+        for activity_id, (start, end) in ranges.items():
+            stats[activity_id] = build_activity_stats(
+                activity_id, histories[activity_id], start, end
+            )
+            if cacheable:
+                stats_cache.set(activity_id, (data_version, stats[activity_id]))
+
+    return [stats[activity_id] for activity_id, _ in activities]
 
-        statement = select(Activities).where(Activities.user_id == user_id)
-        return session.exec(statement).all()
+
+@router.get("", status_code=status.HTTP_200_OK, response_model=list[ActivityFieldsOut])
+async def get_activities(
+    session: Annotated[AsyncSession, Depends(get_read_session)],
+    session_user: Annotated[SessionUser, Depends()],
+    cache_headers: Annotated[dict[str, str], Depends(check_data_version)],
+    active_query: Annotated[ActiveQuery, Depends()],
+    created_query: Annotated[CreatedRangeQuery, Depends()],
+    page_query: Annotated[PageQuery, Depends()],
+    fields_query: Annotated[ActivityFieldsQuery, Depends()],
+) -> ORJSONResponse:
+    """
+    Returns activities ordered by creation time.
+    Active ones have not ended, limit pages them with a cursor in Link header.
+    """
+    where = [Activities.user_id == session_user.user_id]
+    if active_query.active is not None:
+        where.append(
+            Activities.ended_at.is_(None)
+            if active_query.active
+            else Activities.ended_at.is_not(None)
+        )
+    # rows are serialized directly, validating thousands of them is the slow part
+    activities, position = await crud.select_page(
+        session,
+        Activities,
+        "activity_id",
+        fields_query.fields,
+        where,
+        created_query.created_after,
+        created_query.created_before,
+        page_query.after,
+        page_query.limit,
+    )
+    return ORJSONResponse(
+        activities, headers=cache_headers | page_query.next_link(position)
+    )
 
 
 @router.post("", status_code=status.HTTP_200_OK, response_model=ActivityOut)
 async def post_activities(
-    session_cookie: Annotated[SessionCookie, Depends()],
+    session: Annotated[AsyncSession, Depends(get_session)],
+    session_user: Annotated[SessionUser, Depends()],
     activity_in: ActivityIn,
 ) -> ActivityOut:
     """Creates new activity"""
-    with Session(engine) as session:
-        statement = select(Sessions.user_id).where(
-            Sessions.session_id == session_cookie.session_id
-        )
-        user_id = session.exec(statement).first()
-
-        new_activity_entry = Activities(
-            activity_id=create_uuid_v4(),
-            user_id=user_id,
-            title=activity_in.title,
-            description=activity_in.description,
-            created_at=unix_time(),
-            ended_at=None,
+    new_activity_entry = await crud.create_activity(
+        session, session_user.user_id, activity_in
+    )
+    version = await crud.bump_data_version(session, session_user.user_id)
+    await session.commit()
+    await session.refresh(new_activity_entry)
+    activity_out = ActivityOut.model_validate(new_activity_entry, from_attributes=True)
+    event_broker.publish(
+        session_user.user_id, version, events.activity_created(activity_out)
+    )
+    return activity_out
+
+
+@router.get(
+    "/history/{year}",
+    status_code=status.HTTP_200_OK,
+    response_model=list[HistoryOut],
+)
+async def get_activities_year_history(
+    session: Annotated[AsyncSession, Depends(get_read_session)],
+    session_user: Annotated[SessionUser, Depends()],
+    activities_query: Annotated[ActivitiesQuery, Depends()],
+    year_path: Annotated[YearPath, Depends()],
+    cache_headers: Annotated[dict[str, str], Depends(check_data_version)],
+) -> ORJSONResponse:
+    """Returns year history of all or selected activities"""
+    histories = await crud.select_histories(
+        session,
+        session_user.user_id,
+        year_path.year,
+        activity_ids=activities_query.activity_ids,
+    )
+    return ORJSONResponse(histories, headers=cache_headers)
+
+
+@router.get(
+    "/history/{year}/{month}",
+    status_code=status.HTTP_200_OK,
+    response_model=list[HistoryOut],
+)
+async def get_activities_history(
+    session: Annotated[AsyncSession, Depends(get_read_session)],
+    session_user: Annotated[SessionUser, Depends()],
+    activities_query: Annotated[ActivitiesQuery, Depends()],
+    year_path: Annotated[YearPath, Depends()],
+    month_path: Annotated[MonthPath, Depends()],
+    cache_headers: Annotated[dict[str, str], Depends(check_data_version)],
+) -> ORJSONResponse:
+    """Returns month history of all or selected activities"""
+    histories = await crud.select_histories(
+        session,
+        session_user.user_id,
+        year_path.year,
+        month_path.month,
+        activities_query.activity_ids,
+    )
+    return ORJSONResponse(histories, headers=cache_headers)
+
+
+@router.get("/stats", status_code=status.HTTP_200_OK, response_model=UserStatsOut)
+async def get_activities_stats(
+    session: Annotated[AsyncSession, Depends(get_read_session)],
+    session_user: Annotated[SessionUser, Depends()],
+    activities_query: Annotated[ActivitiesQuery, Depends()],
+    date_range: Annotated[DateRangeQuery, Depends()],
+) -> UserStatsOut:
+    """
+    Returns statistics of all or selected activities,
+    by default since each activity was created until today.
+    """
+    activities_stats = await select_activities_stats(
+        session, session_user.user_id, date_range, activities_query.activity_ids
+    )
+    if not activities_stats:
+        today = date.today()
+        return UserStatsOut(
+            start=date_range.start or today,
+            end=date_range.end or today,
+            completed=0,
+            completion_rate=0,
+            weekdays=[0] * 7,
+            activities=[],
         )
 
-        session.add(new_activity_entry)
-        session.commit()
-        session.refresh(new_activity_entry)
-        return new_activity_entry
+    completed = sum(stats.completed for stats in activities_stats)
+    days = sum((stats.end - stats.start).days + 1 for stats in activities_stats)
+    return UserStatsOut(
+        start=min(stats.start for stats in activities_stats),
+        end=max(stats.end for stats in activities_stats),
+        completed=completed,
+        completion_rate=completed / days,
+        weekdays=[
+            sum(counts) for counts in zip(*(s.weekdays for s in activities_stats))
+        ],
+        activities=activities_stats,
+    )
+
+
+@router.get(
+    "/heatmap/{year}", status_code=status.HTTP_200_OK, response_model=HeatmapOut
+)
+async def get_activities_heatmap(
+    session: Annotated[AsyncSession, Depends(get_read_session)],
+    session_user: Annotated[SessionUser, Depends()],
+    activities_query: Annotated[ActivitiesQuery, Depends()],
+    year_path: Annotated[YearPath, Depends()],
+    cache_headers: Annotated[dict[str, str], Depends(check_data_version)],
+) -> ORJSONResponse:
+    """Returns number of all or selected activities done on every day of a year"""
+    heatmap = await crud.select_heatmap(
+        session, session_user.user_id, year_path.year, activities_query.activity_ids
+    )
+    return ORJSONResponse(heatmap, headers=cache_headers)
 
 
 @router.patch("/{activity_id}", status_code=status.HTTP_200_OK)
 async def patch_activity(
-    session_cookie: Annotated[SessionCookie, Depends()],
+    session: Annotated[AsyncSession, Depends(get_session)],
+    session_user: Annotated[SessionUser, Depends()],
     activity_path: Annotated[ActivityPath, Depends()],
     activity_update: ActivityUpdate,
 ) -> None:
     """Updates activity"""
-    with Session(engine) as session:
-        statement = select(Sessions.user_id).where(
-            Sessions.session_id == session_cookie.session_id
-        )
-        user_id = session.exec(statement).first()
-
-        statement = select(Activities).where(
-            Activities.activity_id == activity_path.activity_id
+    values = crud.activity_values(activity_update)
+    found = await crud.update_activity(
+        session, session_user.user_id, activity_path.activity_id, values
+    )
+    if not found:
+        await crud.check_activity(
+            session, session_user.user_id, activity_path.activity_id
         )
-        activity_entry: Activities | None = session.exec(statement).first()
-
-        if not activity_entry:
-            raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Activity not found")
-
-        if not activity_entry.user_id == user_id:
-            raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="Unathorized")
-
-        if activity_update.title:
-            activity_entry.title = activity_update.title
-        if activity_update.description:
-            activity_entry.description = activity_update.description
-        if activity_update.end:
-            if activity_update.end is True:
-                activity_entry.ended_at = unix_time()
-
-        session.add(activity_entry)
-        session.commit()
+    version = await crud.bump_data_version(session, session_user.user_id)
+    await session.commit()
+    event_broker.publish(
+        session_user.user_id,
+        version,
+        events.activity_updated(activity_path.activity_id, values),
+    )
 
     return None
 
 
 @router.delete("/{activity_id}", status_code=status.HTTP_200_OK)
 async def delete_activity(
-    session_cookie: Annotated[SessionCookie, Depends()],
+    session: Annotated[AsyncSession, Depends(get_session)],
+    session_user: Annotated[SessionUser, Depends()],
     activity_path: Annotated[ActivityPath, Depends()],
 ) -> None:
     """Deletes activity"""
-    with Session(engine) as session:
-        statement = select(Sessions.user_id).where(
-            Sessions.session_id == session_cookie.session_id
+    found = await crud.delete_activity(
+        session, session_user.user_id, activity_path.activity_id
+    )
+    if not found:
+        await crud.check_activity(
+            session, session_user.user_id, activity_path.activity_id
         )
-        user_id = session.exec(statement).first()
+    version = await crud.bump_data_version(session, session_user.user_id)
+    await session.commit()
+    stats_cache.pop(activity_path.activity_id)
+    event_broker.publish(
+        session_user.user_id,
+        version,
+        events.activity_deleted(activity_path.activity_id),
+    )
 
-        statement = select(Activities).where(
-            Activities.activity_id == activity_path.activity_id
-        )
-        activity_entry: Activities | None = session.exec(statement).first()
+    return None
 
-        if not activity_entry:
-            raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Activity not found")
 
-        if not activity_entry.user_id == user_id:
-            raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="Unathorized")
+@router.get(
+    "/{activity_id}/stats",
+    status_code=status.HTTP_200_OK,
+    response_model=ActivityStatsOut,
+)
+async def get_activity_stats(
+    session: Annotated[AsyncSession, Depends(get_read_session)],
+    session_user: Annotated[SessionUser, Depends()],
+    activity_path: Annotated[ActivityPath, Depends()],
+    date_range: Annotated[DateRangeQuery, Depends()],
+) -> ActivityStatsOut:
+    """
+    Returns activity statistics,
+    by default since the activity was created until today.
+    """
+    activities_stats = await select_activities_stats(
+        session, session_user.user_id, date_range, [activity_path.activity_id]
+    )
+    if not activities_stats:
+        # tells another user's activity from a missing one, like the other routes
+        await crud.check_activity(
+            session, session_user.user_id, activity_path.activity_id
+        )
+        # created after the stats were read
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Activity not found")
+    return activities_stats[0]
 
-        session.delete(activity_entry)
-        session.commit()
 
-    return None
+@router.get(
+    "/{activity_id}/{year}",
+    status_code=status.HTTP_200_OK,
+    response_model=list[HistoryOut],
+)
+async def get_activity_year_history(
+    session: Annotated[AsyncSession, Depends(get_read_session)],
+    session_user: Annotated[SessionUser, Depends()],
+    activity_path: Annotated[ActivityPath, Depends()],
+    year_path: Annotated[YearPath, Depends()],
+    cache_headers: Annotated[dict[str, str], Depends(check_data_version)],
+) -> ORJSONResponse:
+    """Returns activity history of every month in a year"""
+    histories = await crud.select_activity_histories(
+        session, session_user.user_id, activity_path.activity_id, year_path.year
+    )
+    return ORJSONResponse(histories, headers=cache_headers)
 
 
 @router.get(
@@ -128,73 +397,107 @@ async def delete_activity(
     response_model=list[int],
 )
 async def get_activity_history(
-    session_cookie: Annotated[SessionCookie, Depends()],
+    session: Annotated[AsyncSession, Depends(get_read_session)],
+    session_user: Annotated[SessionUser, Depends()],
     activity_path: Annotated[ActivityPath, Depends()],
     year_path: Annotated[YearPath, Depends()],
     month_path: Annotated[MonthPath, Depends()],
-) -> list[int]:
+    cache_headers: Annotated[dict[str, str], Depends(check_data_version)],
+) -> ORJSONResponse:
     """Returns activity history"""
-    days_bitmap: int | None = None
-    with Session(engine) as session:
-        statement = select(Sessions.user_id).where(
-            Sessions.session_id == session_cookie.session_id
-        )
-        user_id = session.exec(statement).first()
-
-        statement = select(Histories.days).where(
-            Histories.activity_id == activity_path.activity_id,
-            Histories.year == year_path.year,
-            Histories.month == month_path.month,
-        )
-        days_bitmap: int | None = session.exec(statement).first()
-
-    if not days_bitmap:
-        return []
-
-    days: [int] = []
-    for i in range(days_bitmap.bit_length()):
-        day = (days_bitmap >> i) & 1
-        if day == 1:
-            days.append(i + 1)
-    return days
+    histories = await crud.select_activity_histories(
+        session,
+        session_user.user_id,
+        activity_path.activity_id,
+        year_path.year,
+        month_path.month,
+    )
+    days = histories[0]["days"] if histories else []
+    return ORJSONResponse(days, headers=cache_headers)
 
 
 @router.patch("/{activity_id}/{year}/{month}/{day}", status_code=status.HTTP_200_OK)
 async def patch_activity_history(
-    session_cookie: Annotated[SessionCookie, Depends()],
+    session: Annotated[AsyncSession, Depends(get_session)],
+    session_user: Annotated[SessionUser, Depends()],
     activity_path: Annotated[ActivityPath, Depends()],
     year_path: Annotated[YearPath, Depends()],
     month_path: Annotated[MonthPath, Depends()],
     day_path: Annotated[DayPath, Depends()],
 ) -> None:
-    """Updates activity history"""
-    with Session(engine) as session:
-        statement = select(Sessions.user_id).where(
-            Sessions.session_id == session_cookie.session_id
+    """Toggles day in activity history"""
+    found = await crud.toggle_history_day(
+        session,
+        session_user.user_id,
+        activity_path.activity_id,
+        year_path.year,
+        month_path.month,
+        day_path.day,
+    )
+    if not found:
+        await crud.check_activity(
+            session, session_user.user_id, activity_path.activity_id
         )
-        user_id = session.exec(statement).first()
+    version = await crud.bump_data_version(session, session_user.user_id)
+    await session.commit()
+    stats_cache.pop(activity_path.activity_id)
+    event_broker.publish(
+        session_user.user_id,
+        version,
+        events.history_toggled(
+            activity_path.activity_id,
+            year_path.year,
+            month_path.month,
+            day_path.day,
+        ),
+    )
+
+    return None
 
-        statement = select(Histories).where(
-            Histories.activity_id == activity_path.activity_id,
-            Histories.year == year_path.year,
-            Histories.month == month_path.month,
+
+@router.patch("/{activity_id}/{year}/{month}", status_code=status.HTTP_200_OK)
+async def patch_activity_history_days(
+    session: Annotated[AsyncSession, Depends(get_session)],
+    session_user: Annotated[SessionUser, Depends()],
+    activity_path: Annotated[ActivityPath, Depends()],
+    year_path: Annotated[YearPath, Depends()],
+    month_path: Annotated[MonthPath, Depends()],
+    history_update: HistoryUpdate,
+) -> None:
+    """
+    Sets and clears days in activity history.
+    Repeating the same update has no further effect.
+    """
+    if not history_update.set_days and not history_update.clear_days:
+        await crud.check_activity(
+            session, session_user.user_id, activity_path.activity_id
         )
-        history_entry: Histories | None = session.exec(statement).first()
-
-        if not history_entry:
-            days = 1 << day_path.day - 1
-            new_history_entry = Histories(
-                history_id=create_uuid_v4(),
-                activity_id=activity_path.activity_id,
-                year=year_path.year,
-                month=month_path.month,
-                days=days,
-            )
-            session.add(new_history_entry)
-            session.commit()
-        else:
-            history_entry.days = history_entry.days ^ 1 << day_path.day - 1
-            session.add(history_entry)
-            session.commit()
+        return None
+
+    found = await crud.update_history_days(
+        session,
+        session_user.user_id,
+        activity_path.activity_id,
+        year_path.year,
+        month_path.month,
+        history_update,
+    )
+    if not found:
+        await crud.check_activity(
+            session, session_user.user_id, activity_path.activity_id
+        )
+    version = await crud.bump_data_version(session, session_user.user_id)
+    await session.commit()
+    stats_cache.pop(activity_path.activity_id)
+    event_broker.publish(
+        session_user.user_id,
+        version,
+        events.history_updated(
+            activity_path.activity_id,
+            year_path.year,
+            month_path.month,
+            history_update,
+        ),
+    )
 
     return None
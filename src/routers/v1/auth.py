@@ -1,14 +1,45 @@
+from contextlib import suppress
 from typing import Annotated
 
-from fastapi import APIRouter, Header, Depends, HTTPException, status, Response
-from sqlmodel import Session, select
+from fastapi import (
+    APIRouter,
+    Header,
+    Depends,
+    HTTPException,
+    status,
+    Request,
+    Response,
+)
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from ...models.user import UserIn, UserOut
-from ...models.session import SessionOut
-from ...dependencies import SessionCookie, UserAgentHeader
-from ...database import engine, Users, Sessions
+from ...models.session import SessionFieldsOut
+from ...dependencies import (
+    get_session,
+    get_read_session,
+    check_sessions_version,
+    SessionUser,
+    UserAgentHeader,
+    ActiveQuery,
+    CreatedRangeQuery,
+    PageQuery,
+    SessionFieldsQuery,
+)
+from ...database import Users, Sessions
 from ...utils import create_uuid_v4, create_session_id, unix_time
-from ...crypto import hash_password, verify_hashed_password
+from ...crypto import (
+    PasswordHasherBusy,
+    hash_password,
+    needs_rehash,
+    verify_hashed_password,
+)
+from ...cache import session_cache
+from ...events import event_broker
+from ... import crud
+from ...ratelimit import address_limiter, username_limiter
 from ...config import SESSION_DURATION
 
 
@@ -17,27 +48,34 @@ router = APIRouter(prefix="/v1/auth", tags=["auth"])
 
 @router.post("/register", status_code=status.HTTP_201_CREATED)
 async def register(
+    session: Annotated[AsyncSession, Depends(get_session)],
     user_agent_header: Annotated[UserAgentHeader, Depends()],
     user_in: UserIn,
+    request: Request,
     response: Response,
 ) -> None:
     """
     Registers a new user.
     Sets session ID in a cookie.
     """
+    address_limiter.check(request.client.host if request.client else None)
+
     # check if username is already taken
-    statement = select(Users.username).where(Users.username == user_in.username)
-    with Session(engine) as session:
-        if session.exec(statement).first():
-            raise HTTPException(
-                status.HTTP_409_CONFLICT, detail="This username is already taken"
-            )
+    statement = select(Users.username).where(
+        Users.username == user_in.username, Users.deleted_at.is_(None)
+    )
+    if (await session.exec(statement)).first():
+        raise HTTPException(
+            status.HTTP_409_CONFLICT, detail="This username is already taken"
+        )
+    # give the connection back to the pool while hashing
+    await session.close()
 
     # register a new user
     new_user_entry = Users(
         user_id=create_uuid_v4(),
         username=user_in.username,
-        password=hash_password(user_in.password),
+        password=await hash_password(user_in.password),
         created_at=unix_time(),
     )
     session_id = create_session_id()
@@ -48,10 +86,18 @@ async def register(
         created_at=unix_time(),
         expires_at=unix_time() + SESSION_DURATION,
     )
-    with Session(engine) as session:
-        session.add(new_user_entry)
-        session.add(new_session_entry)
-        session.commit()
+    session.add(new_user_entry)
+    try:
+        # the user has to be inserted before the session referencing it
+        await session.flush()
+    except IntegrityError:
+        # registered by a concurrent request while hashing
+        await session.rollback()
+        raise HTTPException(
+            status.HTTP_409_CONFLICT, detail="This username is already taken"
+        )
+    session.add(new_session_entry)
+    await session.commit()
 
     # set session_id cookie
     response.set_cookie(
@@ -67,31 +113,53 @@ async def register(
 
 @router.post("/login", status_code=status.HTTP_200_OK)
 async def login(
+    session: Annotated[AsyncSession, Depends(get_session)],
     user_agent_header: Annotated[UserAgentHeader, Depends()],
     user_in: UserIn,
+    request: Request,
     response: Response,
 ) -> None:
     """
     Logs an existing user in.
     Sets session ID in a cookie.
     """
+    address_limiter.check(request.client.host if request.client else None)
+    username_limiter.check(user_in.username)
+
     # check if user exists
-    statement = select(Users).where(Users.username == user_in.username)
+    statement = select(Users).where(
+        Users.username == user_in.username, Users.deleted_at.is_(None)
+    )
     user_entry: Users = None
-    with Session(engine) as session:
-        user_entry = session.exec(statement).first()
-        if not user_entry:
-            raise HTTPException(
-                status.HTTP_401_UNAUTHORIZED, detail="Invalid username or password"
-            )
+    user_entry = (await session.exec(statement)).first()
+    if not user_entry:
+        raise HTTPException(
+            status.HTTP_401_UNAUTHORIZED, detail="Invalid username or password"
+        )
+    # give the connection back to the pool while hashing
+    await session.close()
 
     # verify password
-    is_verified = verify_hashed_password(user_in.password, user_entry.password)
+    is_verified = await verify_hashed_password(user_in.password, user_entry.password)
     if not is_verified:
         raise HTTPException(
             status.HTTP_401_UNAUTHORIZED, detail="Invalid username or password"
         )
 
+    # hashed with older parameters, store a hash with the current ones
+    if needs_rehash(user_entry.password):
+        # the old hash still works, do not fail the login over it
+        with suppress(PasswordHasherBusy):
+            statement = (
+                update(Users)
+                .where(
+                    Users.user_id == user_entry.user_id,
+                    Users.password == user_entry.password,
+                )
+                .values(password=await hash_password(user_in.password))
+            )
+            await session.exec(statement)
+
     # verified, create new session
     session_id = create_session_id()
     new_session_entry = Sessions(
@@ -101,9 +169,9 @@ async def login(
         created_at=unix_time(),
         expires_at=unix_time() + SESSION_DURATION,
     )
-    with Session(engine) as session:
-        session.add(new_session_entry)
-        session.commit()
+    session.add(new_session_entry)
+    await crud.bump_data_version(session, user_entry.user_id)
+    await session.commit()
 
     # set session-id cookie
     response.set_cookie(
@@ -118,40 +186,76 @@ async def login(
 
 
 @router.get(
-    "/sessions", status_code=status.HTTP_200_OK, response_model=list[SessionOut]
+    "/sessions", status_code=status.HTTP_200_OK, response_model=list[SessionFieldsOut]
 )
 async def get_sessions(
-    session_cookie: Annotated[SessionCookie, Depends()]
-) -> list[SessionOut]:
-    """Returns all active sessions"""
-    statement = select(Sessions.user_id).where(
-        Sessions.session_id == session_cookie.session_id
+    session: Annotated[AsyncSession, Depends(get_read_session)],
+    session_user: Annotated[SessionUser, Depends()],
+    cache_headers: Annotated[dict[str, str], Depends(check_sessions_version)],
+    active_query: Annotated[ActiveQuery, Depends()],
+    created_query: Annotated[CreatedRangeQuery, Depends()],
+    page_query: Annotated[PageQuery, Depends()],
+    fields_query: Annotated[SessionFieldsQuery, Depends()],
+) -> ORJSONResponse:
+    """
+    Returns sessions ordered by creation time.
+    Active ones have not expired, limit pages them with a cursor in Link header.
+    """
+    where = [Sessions.user_id == session_user.user_id]
+    if active_query.active is not None:
+        now = unix_time()
+        where.append(
+            Sessions.expires_at > now
+            if active_query.active
+            else Sessions.expires_at <= now
+        )
+    sessions, position = await crud.select_page(
+        session,
+        Sessions,
+        "session_id",
+        fields_query.fields,
+        where,
+        created_query.created_after,
+        created_query.created_before,
+        page_query.after,
+        page_query.limit,
+    )
+    return ORJSONResponse(
+        sessions, headers=cache_headers | page_query.next_link(position)
     )
-    with Session(engine) as session:
-        user_id = session.exec(statement).first()
-
-        statement = select(Sessions).where(Sessions.user_id == user_id)
-        return session.exec(statement).all()
 
 
 @router.patch("/sessions", status_code=status.HTTP_204_NO_CONTENT)
-async def patch_session(session_cookie: Annotated[SessionCookie, Depends()]) -> None:
+async def patch_session(
+    session: Annotated[AsyncSession, Depends(get_session)],
+    session_user: Annotated[SessionUser, Depends()],
+) -> None:
     """Updates session expiration time"""
-    statement = select(Sessions).where(Sessions.session_id == session_cookie.session_id)
-    with Session(engine) as session:
-        session_entry: Sessions = session.exec(statement).first()
-        session_entry.expires_at = unix_time() + SESSION_DURATION
-        session.add(session_entry)
-        session.commit()
+    statement = select(Sessions).where(Sessions.session_id == session_user.session_id)
+    session_entry: Sessions = (await session.exec(statement)).first()
+    if session_entry is None:
+        raise session_user.reject()
+    session_entry.expires_at = unix_time() + SESSION_DURATION
+    session.add(session_entry)
+    await crud.bump_data_version(session, session_user.user_id)
+    await session.commit()
+    session_cache.pop(session_user.session_id)
     return None
 
 
 @router.delete("/sessions", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_session(session_cookie: Annotated[SessionCookie, Depends()]) -> None:
+async def delete_session(
+    session: Annotated[AsyncSession, Depends(get_session)],
+    session_user: Annotated[SessionUser, Depends()],
+) -> None:
     """Deletes session"""
-    statement = select(Sessions).where(Sessions.session_id == session_cookie.session_id)
-    with Session(engine) as session:
-        session_entry: Sessions = session.exec(statement).first()
-        session.delete(session_entry)
-        session.commit()
+    statement = select(Sessions).where(Sessions.session_id == session_user.session_id)
+    session_entry: Sessions = (await session.exec(statement)).first()
+    if session_entry is None:
+        raise session_user.reject()
+    await session.delete(session_entry)
+    await crud.bump_data_version(session, session_user.user_id)
+    await session.commit()
+    session_cache.pop(session_user.session_id)
+    event_broker.close(session_user.user_id, session_user.session_id)
     return None
@@ -0,0 +1,131 @@
+from typing import Annotated
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ...models.activity import ActivityOut
+from ...models.batch import (
+    ActivityRef,
+    BatchIn,
+    BatchOut,
+    CreateActivity,
+    DeleteActivity,
+    Operation,
+    OperationOut,
+    ToggleHistoryDay,
+    UpdateActivity,
+    UpdateHistoryDays,
+)
+from ...dependencies import get_session, SessionUser
+from ... import crud, events
+from ...cache import stats_cache
+from ...events import Event, event_broker
+
+
+router = APIRouter(prefix="/v1/batch", tags=["batch"])
+
+
+def resolve_activity(activity_ref: ActivityRef, created: dict[int, UUID]) -> UUID:
+    """Returns ID of activity, created by an earlier operation when given its index"""
+    if isinstance(activity_ref, UUID):
+        return activity_ref
+    if activity_ref not in created:
+        raise HTTPException(
+            status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Operation {activity_ref} did not create an activity before",
+        )
+    return created[activity_ref]
+
+
+async def run_operation(
+    session: AsyncSession,
+    user_id: UUID,
+    index: int,
+    operation: Operation,
+    created: dict[int, UUID],
+) -> tuple[OperationOut, UUID, Event]:
+    """
+    Runs operation, returns its result, ID of the activity it changed
+    and event to publish once committed.
+    Every operation is a single statement, a failed one has changed nothing.
+    """
+    if isinstance(operation, CreateActivity):
+        activity = await crud.create_activity(session, user_id, operation.activity)
+        created[index] = activity.activity_id
+        activity_out = ActivityOut.model_validate(activity, from_attributes=True)
+        result = OperationOut(status=status.HTTP_200_OK, activity=activity_out)
+        return result, activity.activity_id, events.activity_created(activity_out)
+
+    activity_id = resolve_activity(operation.activity_id, created)
+    if isinstance(operation, UpdateActivity):
+        values = crud.activity_values(operation.update)
+        found = await crud.update_activity(session, user_id, activity_id, values)
+        event = events.activity_updated(activity_id, values)
+    elif isinstance(operation, DeleteActivity):
+        found = await crud.delete_activity(session, user_id, activity_id)
+        event = events.activity_deleted(activity_id)
+    elif isinstance(operation, ToggleHistoryDay):
+        found = await crud.toggle_history_day(
+            session,
+            user_id,
+            activity_id,
+            operation.year,
+            operation.month,
+            operation.day,
+        )
+        event = events.history_toggled(
+            activity_id, operation.year, operation.month, operation.day
+        )
+    elif isinstance(operation, UpdateHistoryDays):
+        found = await crud.update_history_days(
+            session,
+            user_id,
+            activity_id,
+            operation.year,
+            operation.month,
+            operation.update,
+        )
+        event = events.history_updated(
+            activity_id, operation.year, operation.month, operation.update
+        )
+    if not found:
+        await crud.check_activity(session, user_id, activity_id)
+    return OperationOut(status=status.HTTP_200_OK), activity_id, event
+
+
+@router.post("", status_code=status.HTTP_200_OK, response_model=BatchOut)
+async def post_batch(
+    session: Annotated[AsyncSession, Depends(get_session)],
+    session_user: Annotated[SessionUser, Depends()],
+    batch_in: BatchIn,
+) -> BatchOut:
+    """
+    Runs operations in order in one transaction, with one result per operation.
+    A failed operation changes nothing and does not stop the following ones.
+    Later operations refer to an activity created in the batch by the index
+    of its create_activity operation.
+    """
+    results: list[OperationOut] = []
+    created: dict[int, UUID] = {}
+    changed: set[UUID] = set()
+    changes: list[Event] = []
+    for index, operation in enumerate(batch_in.operations):
+        try:
+            result, activity_id, event = await run_operation(
+                session, session_user.user_id, index, operation, created
+            )
+        except HTTPException as error:
+            result = OperationOut(status=error.status_code, detail=error.detail)
+        else:
+            changed.add(activity_id)
+            changes.append(event)
+        results.append(result)
+
+    if changed:
+        version = await crud.bump_data_version(session, session_user.user_id)
+        await session.commit()
+        for activity_id in changed:
+            stats_cache.pop(activity_id)
+        event_broker.publish(session_user.user_id, version, *changes)
+    return BatchOut(results=results)
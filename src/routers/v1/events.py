@@ -0,0 +1,37 @@
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
+
+from ...dependencies import SessionUser
+from ...events import event_broker, stream_events
+from ...config import EVENTS_MAX_STREAMS
+
+
+router = APIRouter(prefix="/v1/events", tags=["events"])
+
+
+@router.get(
+    "",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    responses={200: {"content": {"text/event-stream": {}}}},
+)
+async def get_events(
+    session_user: Annotated[SessionUser, Depends()],
+) -> StreamingResponse:
+    """
+    Streams changes of activities and histories as server-sent events,
+    starting with ready event carrying the current data version.
+    """
+    # counted before the stream subscribes, simultaneous connects may pass it
+    if event_broker.streams(session_user.user_id) >= EVENTS_MAX_STREAMS:
+        raise HTTPException(
+            status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many event streams"
+        )
+    return StreamingResponse(
+        stream_events(session_user.user_id, session_user.session_id),
+        media_type="text/event-stream",
+        # proxies must pass events on as they come
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,41 +1,117 @@
 from typing import Annotated
 
-from fastapi import APIRouter, status, Depends
-from sqlmodel import Session, select
+from fastapi import APIRouter, BackgroundTasks, status, Depends, Request
+from fastapi.responses import StreamingResponse
+from sqlmodel import delete, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from ...dependencies import SessionCookie
+from ...dependencies import (
+    get_session,
+    get_read_session,
+    SessionUser,
+    ExportFormatQuery,
+)
 from ...models.user import UserOut
-from ...database import engine, Users, Sessions
+from ...models.activity import ActivityImportOut
+from ...database import Users, Sessions
+from ...cache import session_cache
+from ...events import event_broker
+from ...export import export_csv, export_ndjson
+from ...bulk_import import import_ndjson
+from ...tasks import delete_user_data
+from ...utils import unix_time
 
 
 router = APIRouter(prefix="/v1/user", tags=["user"])
 
 
 @router.get("", status_code=status.HTTP_200_OK, response_model=UserOut)
-async def get_user(session_cookie: Annotated[SessionCookie, Depends()]) -> UserOut:
+async def get_user(
+    session: Annotated[AsyncSession, Depends(get_read_session)],
+    session_user: Annotated[SessionUser, Depends()],
+) -> UserOut:
     """Returns user data"""
-    with Session(engine) as session:
-        statement = select(Sessions.user_id).where(
-            Sessions.session_id == session_cookie.session_id
+    statement = select(Users).where(
+        Users.user_id == session_user.user_id, Users.deleted_at.is_(None)
+    )
+    user_entry = (await session.exec(statement)).first()
+    if user_entry is None:
+        raise session_user.reject()
+    return user_entry
+
+
+@router.get(
+    "/export",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    responses={
+        200: {"content": {"application/x-ndjson": {}, "text/csv": {}}},
+    },
+)
+async def export_user(
+    session_user: Annotated[SessionUser, Depends()],
+    export_format: Annotated[ExportFormatQuery, Depends()],
+) -> StreamingResponse:
+    """Streams all activities with their history as NDJSON or CSV"""
+    # no session dependency, it would be closed before the response is streamed
+    if export_format.format == "csv":
+        content, media_type = export_csv(session_user.user_id), "text/csv"
+    else:
+        content, media_type = (
+            export_ndjson(session_user.user_id),
+            "application/x-ndjson",
         )
-        user_id = session.exec(statement).first()
+    filename = f"routina-export.{export_format.format}"
+    return StreamingResponse(
+        content,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
-        statement = select(Users).where(Users.user_id == user_id)
-        return session.exec(statement).first()
 
+@router.post(
+    "/import",
+    status_code=status.HTTP_200_OK,
+    response_model=ActivityImportOut,
+    openapi_extra={
+        "requestBody": {
+            "content": {"application/x-ndjson": {"schema": {"type": "string"}}},
+            "required": True,
+        },
+    },
+)
+async def import_user(
+    request: Request,
+    session_user: Annotated[SessionUser, Depends()],
+) -> ActivityImportOut:
+    """
+    Imports activities with days they were done from NDJSON body,
+    one activity per line. Reports invalid lines instead of failing.
+    """
+    return await import_ndjson(session_user.user_id, request.stream())
 
-@router.delete("", status_code=status.HTTP_200_OK)
-async def delete_user(session_cookie: Annotated[SessionCookie, Depends()]) -> None:
-    """Deletes user"""
-    with Session(engine) as session:
-        statement = select(Sessions.user_id).where(
-            Sessions.session_id == session_cookie.session_id
-        )
-        user_id = session.exec(statement).first()
 
-        statement = select(Users).where(Users.user_id == user_id)
-        user_entry = session.exec(statement).first()
-        session.delete(user_entry)
-        session.commit()
+@router.delete("", status_code=status.HTTP_200_OK)
+async def delete_user(
+    session: Annotated[AsyncSession, Depends(get_session)],
+    session_user: Annotated[SessionUser, Depends()],
+    background_tasks: BackgroundTasks,
+) -> None:
+    """
+    Deletes user.
+    Signs out its sessions at once, the rest of its data is deleted in the background.
+    """
+    statement = delete(Sessions).where(Sessions.user_id == session_user.user_id)
+    await session.exec(statement)
+    statement = (
+        update(Users)
+        .where(Users.user_id == session_user.user_id)
+        .values(deleted_at=unix_time())
+    )
+    await session.exec(statement)
+    await session.commit()
+    session_cache.invalidate_user(session_user.user_id)
+    event_broker.close(session_user.user_id)
+    background_tasks.add_task(delete_user_data, session_user.user_id)
 
     return None
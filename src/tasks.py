@@ -0,0 +1,171 @@
+"""
+Background database maintenance.
+
+Delete data orphaned by users deleted before foreign keys cascaded:
+python -m src.tasks
+"""
+
+import asyncio
+import logging
+from typing import Any
+from uuid import UUID
+
+from sqlalchemy import Select
+from sqlalchemy.exc import OperationalError
+from sqlmodel import delete, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from .database import engine, Users, Sessions, Activities, Histories
+from .utils import unix_time
+from .config import (
+    SESSION_SWEEP_INTERVAL,
+    SESSION_SWEEP_BATCH_SIZE,
+    SESSION_SWEEP_MAX_BACKOFF,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+async def delete_in_batches(column: Any, selected: Select, batch_size: int) -> int:
+    """
+    Deletes rows with column value in selected, at most batch_size per transaction.
+    Returns number of deleted rows.
+    """
+    deleted = 0
+    while True:
+        statement = delete(column.table).where(column.in_(selected.limit(batch_size)))
+        async with AsyncSession(engine) as session:
+            result = await session.exec(statement)
+            await session.commit()
+        deleted += result.rowcount
+        if result.rowcount < batch_size:
+            return deleted
+        # let waiting writers in between batches
+        await asyncio.sleep(0)
+
+
+async def delete_expired_sessions(batch_size: int) -> int:
+    """
+    Deletes expired sessions and bumps data version of their users,
+    returns number of deleted sessions.
+    """
+    now = unix_time()
+    statement = select(Sessions.user_id).where(Sessions.expires_at < now).distinct()
+    async with AsyncSession(engine) as session:
+        user_ids = (await session.exec(statement)).all()
+
+    expired = select(Sessions.session_id).where(Sessions.expires_at < now)
+    deleted = await delete_in_batches(Sessions.session_id, expired, batch_size)
+    # after deleting, a session list read in between would be cached as current
+    for start in range(0, len(user_ids), batch_size):
+        statement = (
+            update(Users)
+            .where(Users.user_id.in_(user_ids[start : start + batch_size]))
+            .values(data_version=Users.data_version + 1)
+        )
+        async with AsyncSession(engine) as session:
+            await session.exec(statement)
+            await session.commit()
+    return deleted
+
+
+async def delete_user_data(
+    user_id: UUID, batch_size: int = SESSION_SWEEP_BATCH_SIZE
+) -> None:
+    """
+    Deletes histories and activities of a deleted user in batches, then the user.
+    Deleting the user alone would cascade to all its data in one long transaction.
+    """
+    # every selected activity loses all its years, at least batch_size rows
+    histories = (
+        select(Histories.activity_id)
+        .join(Activities, Activities.activity_id == Histories.activity_id)
+        .where(Activities.user_id == user_id)
+    )
+    await delete_in_batches(Histories.activity_id, histories, batch_size)
+    activities = select(Activities.activity_id).where(Activities.user_id == user_id)
+    await delete_in_batches(Activities.activity_id, activities, batch_size)
+    async with AsyncSession(engine) as session:
+        await session.exec(delete(Users).where(Users.user_id == user_id))
+        await session.commit()
+
+
+async def delete_deleted_users(batch_size: int) -> int:
+    """
+    Deletes data of users deleted before, whose deletion was interrupted.
+    Returns number of deleted users.
+    """
+    statement = select(Users.user_id).where(Users.deleted_at.is_not(None))
+    async with AsyncSession(engine) as session:
+        user_ids = (await session.exec(statement)).all()
+    for user_id in user_ids:
+        await delete_user_data(user_id, batch_size)
+    return len(user_ids)
+
+
+async def delete_orphans(batch_size: int = SESSION_SWEEP_BATCH_SIZE) -> dict[str, int]:
+    """
+    Deletes sessions, activities and histories left behind by users
+    deleted before foreign keys cascaded. Returns number of deleted rows per table.
+    """
+    users = select(Users.user_id)
+    owned_activities = select(Activities.activity_id).where(
+        Activities.user_id.in_(users)
+    )
+    # histories first, deleting activities would cascade to them in one transaction
+    return {
+        "sessions": await delete_in_batches(
+            Sessions.session_id,
+            select(Sessions.session_id).where(Sessions.user_id.not_in(users)),
+            batch_size,
+        ),
+        "histories": await delete_in_batches(
+            Histories.activity_id,
+            select(Histories.activity_id).where(
+                Histories.activity_id.not_in(owned_activities)
+            ),
+            batch_size,
+        ),
+        "activities": await delete_in_batches(
+            Activities.activity_id,
+            select(Activities.activity_id).where(Activities.user_id.not_in(users)),
+            batch_size,
+        ),
+    }
+
+
+async def sweep_expired_sessions(
+    interval: int = SESSION_SWEEP_INTERVAL,
+    batch_size: int = SESSION_SWEEP_BATCH_SIZE,
+    max_backoff: int = SESSION_SWEEP_MAX_BACKOFF,
+) -> None:
+    """
+    Deletes expired sessions and data of deleted users every interval seconds,
+    backs off while database is busy. Other errors are logged and the sweep
+    is retried after an interval, the task never ends until cancelled.
+    """
+    delay = interval
+    while True:
+        await asyncio.sleep(delay)
+        try:
+            deleted = await delete_expired_sessions(batch_size)
+            deleted_users = await delete_deleted_users(batch_size)
+        except OperationalError:
+            delay = min(delay * 2, max_backoff)
+            logger.warning("Database is busy, sweeping sessions again in %ds", delay)
+            continue
+        except Exception:
+            delay = interval
+            logger.exception("Sweeping sessions failed, trying again in %ds", delay)
+            continue
+        delay = interval
+        logger.info("Deleted %d expired sessions", deleted)
+        if deleted_users:
+            logger.info("Finished deleting %d users", deleted_users)
+
+
+if __name__ == "__main__":
+    # one-off cleanup of databases from before user deletion cascaded
+    for table, count in asyncio.run(delete_orphans()).items():
+        print(f"Deleted {count} orphaned {table}")